@@ -0,0 +1,111 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+
+# Maximum cached answers, seconds an answer stays valid, and the cosine similarity above which
+# a differently worded question reuses a cached answer (0 disables similarity matching)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 1024))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 3600))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", 0))
+
+NON_WORD_PATTERN = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase a question and collapse punctuation and whitespace"""
+    return NON_WORD_PATTERN.sub(" ", question.lower()).strip()
+
+
+def context_digest(chunks: List[str]) -> str:
+    """Digest of the retrieved context an answer was generated from"""
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk.encode('utf-8'))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class AnswerCache:
+    """Bounded LRU cache of answers with a TTL, keyed by normalized question and context digest"""
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL,
+                 similarity_threshold: float = ANSWER_CACHE_SIMILARITY, embedder=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        # Only needed for similarity matching
+        self.embedder = embedder if similarity_threshold > 0 else None
+        self.entries: "OrderedDict[tuple, Dict]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "similar_hits": 0, "misses": 0, "evictions": 0,
+                      "invalidations": 0, "saved_seconds": 0.0}
+
+    def get(self, question: str, chunks: List[str]) -> Optional[str]:
+        """Return a cached answer for the question and context, or None"""
+        key = (normalize_question(question), context_digest(chunks))
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry["expires"] <= now:
+                del self.entries[key]
+                entry = None
+            if entry:
+                self.entries.move_to_end(key)
+        if entry:
+            return self._hit(entry, "hits")
+
+        if self.embedder is not None:
+            entry = self._similar_entry(key[0], now)
+            if entry:
+                return self._hit(entry, "similar_hits")
+
+        with self.lock:
+            self.stats["misses"] += 1
+        return None
+
+    def put(self, question: str, chunks: List[str], answer: str, latency: float):
+        """Cache an answer along with how long it took to generate"""
+        normalized = normalize_question(question)
+        entry = {"answer": answer, "latency": latency, "expires": time.monotonic() + self.ttl}
+        if self.embedder is not None:
+            entry["embedding"] = self.embedder.embed([normalized])[0]
+        with self.lock:
+            key = (normalized, context_digest(chunks))
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self):
+        """Drop every cached answer, e.g. after the knowledge base changed"""
+        with self.lock:
+            self.entries.clear()
+            self.stats["invalidations"] += 1
+
+    def snapshot(self) -> Dict:
+        """Current counters and size"""
+        with self.lock:
+            return dict(self.stats, size=len(self.entries))
+
+    def _hit(self, entry: Dict, counter: str) -> str:
+        with self.lock:
+            self.stats[counter] += 1
+            self.stats["saved_seconds"] += entry["latency"]
+        return entry["answer"]
+
+    def _similar_entry(self, normalized: str, now: float) -> Optional[Dict]:
+        """Most similar live entry above the threshold, if any"""
+        with self.lock:
+            candidates = [entry for entry in self.entries.values() if entry["expires"] > now]
+        if not candidates:
+            return None
+        query = self.embedder.embed([normalized])[0]
+        similarities = np.stack([entry["embedding"] for entry in candidates]) @ query
+        best = int(np.argmax(similarities))
+        return candidates[best] if similarities[best] >= self.similarity_threshold else None
@@ -1,18 +1,62 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import uvicorn
+import hmac
+import json
 import os
+import threading
+import time
+from contextlib import asynccontextmanager
 from models import QuestionRequest, AnswerResponse, ConversationRequest
-from rag_system import RAGSystem
+from scheduler import LLMUnavailable
+from metrics import REGISTRY, REQUEST_SECONDS, TIMING_HEADER, request_timings, reset_request_timing, server_timing_header, start_request_timing
+from typing import Optional
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Initialize RAG system
-rag_system = RAGSystem()
+# Token expected in the X-Admin-Token header of admin endpoints; when unset they refuse every request
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
-app = FastAPI()
+# When the app module was imported, to report how long startup took
+STARTED_AT = time.perf_counter()
+
+# Built by the startup thread, so the server accepts connections while the knowledge base loads
+rag_system = None
+startup = {"stage": "starting", "error": None, "ready_after_seconds": None}
+
+def start_rag_system():
+    """Import and initialize the RAG system in the background; /api/ready reports its progress"""
+    global rag_system
+    try:
+        startup["stage"] = "importing"
+        from rag_system import RAGSystem
+        rag_system = RAGSystem(initialize=False)
+        startup["stage"] = "loading_knowledge_base"
+        rag_system.initialize()
+    except Exception as e:
+        print(f"Error initializing RAG system: {e}")
+        startup.update(stage="failed", error=str(e))
+        return
+    startup.update(stage="ready", ready_after_seconds=time.perf_counter() - STARTED_AT)
+    print(f"Ready to answer {startup['ready_after_seconds']:.2f}s after startup")
+    
+    # Create the model now rather than on the first question
+    try:
+        from config import get_model
+        get_model()
+    except Exception as e:
+        print(f"Error loading model: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    threading.Thread(target=start_rag_system, name="startup", daemon=True).start()
+    print(f"Accepting connections {time.perf_counter() - STARTED_AT:.2f}s after startup; loading knowledge base in the background")
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -23,15 +67,79 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.post("/api/answer", response_model=AnswerResponse)
+async def observe_when_sent(body_iterator, started: float, path: str):
+    """Pass the response body through, recording the request's latency once the last byte is sent"""
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, path=path)
+
+@app.middleware("http")
+async def record_request_timing(request: Request, call_next):
+    token = start_request_timing()
+    timings = request_timings()
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        reset_request_timing(token)
+    # Label by route template so unknown paths can't create unbounded label values
+    route = request.scope.get("route")
+    # Streamed answers run the model while the body is sent, so the latency is recorded when it ends
+    response.body_iterator = observe_when_sent(response.body_iterator, started, getattr(route, "path", "unmatched"))
+    if TIMING_HEADER:
+        # Headers go out before a streamed body, so for streams they can only report the time to first byte
+        streamed = response.headers.get("content-type", "").startswith("text/event-stream")
+        elapsed = time.perf_counter() - started
+        response.headers["Server-Timing"] = server_timing_header(dict(timings, **{"ttfb" if streamed else "total": elapsed}))
+    return response
+
+@app.exception_handler(LLMUnavailable)
+async def llm_unavailable(request: Request, error: LLMUnavailable):
+    # Shed load fast and tell clients when to come back, rather than letting them time out
+    return JSONResponse(status_code=503, content={"detail": str(error), "reason": error.reason},
+                        headers={"Retry-After": str(error.retry_after)})
+
+def require_ready():
+    if rag_system is None or not rag_system.ready.is_set():
+        raise HTTPException(status_code=503, detail="The knowledge base is still loading", headers={"Retry-After": "5"})
+
+@app.post("/api/answer", response_model=AnswerResponse, dependencies=[Depends(require_ready)])
 async def get_answer(request: QuestionRequest):
     if not request.question or len(request.question.strip()) == 0:
         raise HTTPException(status_code=400, detail="Question cannot be empty")
     
-    result = rag_system.answer_question(request.question, request.conversation_id)
+    result = await rag_system.answer_question_async(request.question, request.conversation_id)
     return result
 
-@app.post("/api/clear-conversation")
+def format_sse(event: dict) -> str:
+    """Format an answer event as a Server-Sent Events message"""
+    return f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+@app.post("/api/answer/stream", dependencies=[Depends(require_ready)])
+async def stream_answer(request: QuestionRequest, http_request: Request):
+    if not request.question or len(request.question.strip()) == 0:
+        raise HTTPException(status_code=400, detail="Question cannot be empty")
+    
+    async def events():
+        stream = rag_system.answer_question_stream(request.question, request.conversation_id)
+        try:
+            async for event in stream:
+                if await http_request.is_disconnected():
+                    break
+                yield format_sse(event)
+        finally:
+            # Closing the stream cancels the upstream generation when the client goes away
+            await stream.aclose()
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/api/clear-conversation", dependencies=[Depends(require_ready)])
 async def clear_conversation(request: ConversationRequest):
     results = rag_system.clear_conversations(request.conversation_ids)
     
@@ -49,10 +157,51 @@ async def clear_conversation(request: ConversationRequest):
         }
     }
 
+@app.get("/api/cache", dependencies=[Depends(require_ready)])
+async def cache_stats():
+    return rag_system.answer_cache.snapshot()
+
+@app.get("/api/llm", dependencies=[Depends(require_ready)])
+async def llm_status():
+    return rag_system.scheduler.status()
+
+@app.get("/api/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set ADMIN_TOKEN to enable them")
+    if not hmac.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.post("/api/reindex", status_code=202, dependencies=[Depends(require_admin), Depends(require_ready)])
+async def reindex():
+    # The rebuild runs in the background; answers keep using the current snapshot until it is swapped
+    if not rag_system.start_refresh():
+        raise HTTPException(status_code=409, detail="A refresh is already running")
+    return {"status": "started", **rag_system.knowledge_base.status()}
+
+@app.get("/api/reindex", dependencies=[Depends(require_admin), Depends(require_ready)])
+async def reindex_status():
+    return rag_system.knowledge_base.status()
+
 @app.get("/api/health")
 async def health_check():
+    # Liveness: the process is serving, whether or not the knowledge base has loaded
     return {"status": "healthy"}
 
+@app.get("/api/ready")
+async def readiness(response: Response):
+    # Readiness: 503 with ingestion progress until the knowledge base is loaded
+    ready = rag_system is not None and rag_system.ready.is_set()
+    status = dict(startup, ready=ready, uptime_seconds=time.perf_counter() - STARTED_AT)
+    if rag_system is not None:
+        status["knowledge_base"] = rag_system.knowledge_base.status()
+    if not ready:
+        response.status_code = 503
+    return status
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8282))
     uvicorn.run("app:app", host="0.0.0.0", port=port, reload=True)
\ No newline at end of file
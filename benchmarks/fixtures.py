@@ -0,0 +1,118 @@
+import os
+import random
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+TOPICS = ["demat account", "trading hours", "brokerage charges", "margin trading", "mutual funds",
+          "IPO application", "fund transfer", "KYC verification", "options trading", "stop loss orders"]
+
+
+def paragraph(rng: random.Random, topic: str, sentences: int = 4) -> str:
+    """A few sentences of plausible support text about a topic"""
+    templates = [
+        "To manage your {t}, open the app and go to the {t} section.",
+        "Charges for {t} depend on your plan and are shown before you confirm.",
+        "If your {t} request fails, check that your Aadhaar is linked to your mobile number.",
+        "Most {t} requests are processed within {n} working days.",
+        "You can track the status of your {t} from the orders page at any time.",
+        "Our support team can help with {t} questions between 8 AM and {n} PM.",
+    ]
+    return " ".join(rng.choice(templates).format(t=topic, n=rng.randint(2, 9)) for _ in range(sentences))
+
+
+def build_site(directory: str, pages: int, links_per_page: int = 5, seed: int = 7) -> str:
+    """Write a synthetic support site under directory/support and return its root path"""
+    rng = random.Random(seed)
+    support = os.path.join(directory, "support")
+    os.makedirs(support, exist_ok=True)
+    for index in range(pages):
+        topic = TOPICS[index % len(TOPICS)]
+        links = "".join(f'<li><a href="/support/page-{rng.randrange(pages)}">Related</a></li>'
+                        for _ in range(links_per_page))
+        body = "".join(f"<p>{paragraph(rng, topic)}</p>" for _ in range(rng.randint(3, 8)))
+        html = (f"<html><head><title>{topic}</title></head><body>"
+                f"<nav><a href='/support/page-0'>Support home</a></nav>"
+                f"<article><h1>{topic.title()} help #{index}</h1>{body}</article>"
+                f"<ul>{links}</ul><footer><p>Angel One Limited. All rights reserved. Investments are subject to market risks.</p></footer>"
+                f"</body></html>")
+        with open(os.path.join(support, f"page-{index}"), "w", encoding="utf-8") as file:
+            file.write(html)
+    return "/support/page-0"
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def guess_type(self, path):
+        return "text/html"
+
+
+def serve_directory(directory: str) -> ThreadingHTTPServer:
+    """Serve a directory on a free localhost port from a background thread"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages: List[List[str]]):
+    """Write a minimal PDF with one Helvetica text line per list entry"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for lines in pages:
+        stream = ["BT /F1 10 Tf 14 TL 40 800 Td"]
+        stream.extend(f"({_pdf_escape(line)}) Tj T*" for line in lines)
+        stream.append("ET")
+        content = "\n".join(stream).encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids)
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as file:
+        file.write(output)
+
+
+def build_corpus(directory: str, pdf_pages: int, seed: int = 11) -> int:
+    """Write synthetic plan PDFs totalling pdf_pages pages plus one DOCX; returns the page count"""
+    import docx
+
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    plans = ["Gold 2500", "Bronze 5000", "HSA 5000", "Copper 7350"]
+    for plan_index, plan in enumerate(plans):
+        pages = []
+        for page in range(pdf_pages // len(plans) + (plan_index < pdf_pages % len(plans))):
+            lines = [f"Summary of Benefits: {plan}", ""]
+            for row in range(40):
+                amount = rng.choice([0, 20, 35, 50, 250, 500, 2500])
+                lines.append(f"Benefit {page}-{row}: ${amount} copay in-network, 40% coinsurance out-of-network")
+            pages.append(lines)
+        write_pdf(os.path.join(directory, f"Synthetic_{plan.replace(' ', '_')}_SOB.pdf"), pages)
+
+    document = docx.Document()
+    document.add_heading("Medical Questions", level=1)
+    for topic in TOPICS:
+        document.add_paragraph(paragraph(rng, topic, sentences=6))
+    table = document.add_table(rows=len(plans), cols=3)
+    for row, plan in zip(table.rows, plans):
+        row.cells[0].text, row.cells[1].text, row.cells[2].text = plan, "$2,500", "$5,000"
+    document.save(os.path.join(directory, "Synthetic_Medical_Questions.docx"))
+    return pdf_pages + 1
@@ -0,0 +1,318 @@
+"""Offline benchmarks for the answer path and the ingestion pipeline.
+
+Serves a synthetic support site from a local HTTP server, generates synthetic PDF/DOCX
+corpora of increasing size, and replaces the Gemini model with a stub, so nothing leaves
+the machine. Results are printed and written as JSON for comparing commits:
+
+    python -m benchmarks.run [--quick] [--output benchmarks/results]
+"""
+import argparse
+import json
+import math
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List
+import requests
+from benchmarks.fixtures import TOPICS, build_corpus, build_site, serve_directory
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def process_memory_mb() -> Dict[str, float]:
+    """Resident, proportional (shared pages split between processes) and private memory, from /proc on Linux"""
+    fields = {"Rss": "rss_mb", "Pss": "pss_mb", "Private_Clean": "private_mb", "Private_Dirty": "private_mb"}
+    memory = {"rss_mb": 0.0, "pss_mb": 0.0, "private_mb": 0.0}
+    with open("/proc/self/smaps_rollup") as file:
+        for line in file:
+            name, _, value = line.partition(":")
+            if name in fields:
+                memory[fields[name]] += int(value.split()[0]) / 1024
+    return memory
+
+
+def chunk_memory_mb(collections) -> Dict[str, float]:
+    """Memory of the collections' chunk stores, and of the same chunks held as lists of strings and dicts"""
+    tracemalloc.start()
+    lists = [(list(collection.documents), list(collection.ids), list(collection.metadatas))
+             for collection in collections]
+    as_lists = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del lists
+    return {"packed_mb": sum(collection.chunks.nbytes for collection in collections) / 2 ** 20,
+            "lists_mb": as_lists / 2 ** 20}
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def child_env(**overrides) -> Dict[str, str]:
+    env = dict(os.environ, GOOGLE_API_KEY="benchmark", CRAWL_RATE_LIMIT="0", MAX_SCRAPE_LEVELS="20")
+    env.update({name: str(value) for name, value in overrides.items()})
+    return env
+
+
+def run_child(mode: str, env: Dict[str, str]) -> Dict:
+    """Run one measurement in a fresh interpreter and return the JSON it prints last"""
+    completed = subprocess.run([sys.executable, "-m", "benchmarks.run", "--child", mode],
+                               cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"{mode} benchmark failed:\n{completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+# Child modes, each run in its own process so RSS and startup time are not polluted
+
+def child_ingest():
+    from benchmarks.stub_model import install_stub_model
+    install_stub_model()
+    from knowledge_base import KnowledgeBase
+
+    knowledge_base = KnowledgeBase()
+    started = time.perf_counter()
+    knowledge_base.refresh()
+    snapshot = knowledge_base.snapshot
+    print(json.dumps({"seconds": time.perf_counter() - started, "web_chunks": snapshot.web.count(),
+                      "document_chunks": snapshot.documents.count(), "peak_rss_mb": peak_rss_mb(),
+                      "deduplication": knowledge_base.last_dedup,
+                      "chunk_memory": chunk_memory_mb(snapshot.collections.values())}))
+
+
+def child_startup():
+    started = time.perf_counter()
+    from benchmarks.stub_model import install_stub_model
+    install_stub_model()
+    from rag_system import RAGSystem
+
+    RAGSystem()
+    print(json.dumps({"seconds": time.perf_counter() - started, "peak_rss_mb": peak_rss_mb()}))
+
+
+def child_attach():
+    """Load the snapshot like a server worker, report memory, and stay alive until stdin closes"""
+    from benchmarks.stub_model import install_stub_model
+    install_stub_model()
+    from rag_system import RAGSystem
+
+    system = RAGSystem()
+    for topic in TOPICS:
+        system.retrieve_context(f"How does {topic} work?")
+    print(json.dumps(process_memory_mb()), flush=True)
+    sys.stdin.read()
+
+
+def child_serve():
+    from benchmarks.stub_model import install_stub_model
+    install_stub_model()
+    import uvicorn
+    import app
+
+    uvicorn.run(app.app, host="127.0.0.1", port=int(os.environ["PORT"]), log_level="warning")
+
+
+# Benchmarks driven from the parent process
+
+def bench_crawl(site_url: str) -> Dict:
+    from crawler import Crawler
+
+    crawler = Crawler(lambda soup: [p.get_text() for p in soup.find_all("p")], rate_limit=0)
+    try:
+        pages = crawler.crawl(site_url, max_levels=20)
+    finally:
+        crawler.close()
+    return {"pages": len(pages), "seconds": crawler.stats["seconds"], "pages_per_sec": crawler.stats["pages_per_sec"]}
+
+
+def last_json_line(stream) -> str:
+    """Skip the child's log lines up to the JSON line it prints"""
+    for line in stream:
+        if line.startswith("{"):
+            return line
+    raise RuntimeError("Benchmark child exited without reporting")
+
+
+def bench_workers(env: Dict[str, str], worker_counts: List[int]) -> List[Dict]:
+    """Memory per process when several worker processes attach to the same snapshot at once"""
+    results = []
+    for count in worker_counts:
+        workers = [subprocess.Popen([sys.executable, "-m", "benchmarks.run", "--child", "attach"], cwd=REPO_ROOT, env=env,
+                                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+                   for _ in range(count)]
+        memory = [json.loads(last_json_line(worker.stdout)) for worker in workers]
+        for worker in workers:
+            worker.stdin.close()
+            worker.wait()
+        results.append({"workers": count, **{name: sum(m[name] for m in memory) / count for name in memory[0]}})
+    return results
+
+
+def bench_answer(port: int, concurrency_levels: List[int], requests_per_level: int) -> List[Dict]:
+    url = f"http://127.0.0.1:{port}/api/answer"
+    results = []
+    for concurrency in concurrency_levels:
+        session = requests.Session()
+        session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+        def ask(index: int) -> float:
+            # Distinct questions, so the answer cache does not short-circuit the model
+            question = f"How does {TOPICS[index % len(TOPICS)]} work? (case {concurrency}-{index})"
+            started = time.perf_counter()
+            response = session.post(url, json={"question": question}, timeout=120)
+            response.raise_for_status()
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(ask, range(requests_per_level)))
+        elapsed = time.perf_counter() - started
+        results.append({
+            "concurrency": concurrency, "requests": requests_per_level,
+            "p50": percentile(latencies, 0.50), "p95": percentile(latencies, 0.95), "p99": percentile(latencies, 0.99),
+            "requests_per_sec": requests_per_level / elapsed,
+        })
+        session.close()
+    return results
+
+
+def wait_for_server(port: int, process: subprocess.Popen, path: str, timeout: float = 120):
+    """Poll path until it answers 200"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Benchmark server exited during startup")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}{path}", timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.02)
+    raise RuntimeError(f"Benchmark server did not answer {path}")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--child", choices=["ingest", "startup", "attach", "serve"], help=argparse.SUPPRESS)
+    parser.add_argument("--quick", action="store_true", help="smaller corpora and fewer requests")
+    parser.add_argument("--output", default=os.path.join(REPO_ROOT, "benchmarks", "results"),
+                        help="directory for the JSON results")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="stub model latency in seconds")
+    parser.add_argument("--llm-output-chars", type=int, default=800, help="stub model answer size")
+    args = parser.parse_args()
+
+    if args.child:
+        {"ingest": child_ingest, "startup": child_startup, "attach": child_attach, "serve": child_serve}[args.child]()
+        return
+
+    site_pages = 50 if args.quick else 300
+    corpus_sizes = [8, 32] if args.quick else [8, 64, 256]
+    concurrency_levels = [1, 8] if args.quick else [1, 4, 16, 64]
+    worker_counts = [1, 2] if args.quick else [1, 2, 4, 8]
+    requests_per_level = 16 if args.quick else 128
+
+    results = {"commit": git_commit(), "started_at": datetime.now(timezone.utc).isoformat(),
+               "settings": {"site_pages": site_pages, "llm_latency": args.llm_latency,
+                            "llm_output_chars": args.llm_output_chars}}
+    stub_env = {"BENCH_LLM_LATENCY": args.llm_latency, "BENCH_LLM_OUTPUT_CHARS": args.llm_output_chars}
+
+    with tempfile.TemporaryDirectory(prefix="rag-bench-") as workdir:
+        site_dir = os.path.join(workdir, "site")
+        root = build_site(site_dir, site_pages)
+        server = serve_directory(site_dir)
+        site_url = f"http://127.0.0.1:{server.server_address[1]}{root}"
+        try:
+            results["crawl"] = bench_crawl(site_url)
+            print(f"crawl: {results['crawl']['pages']} pages at {results['crawl']['pages_per_sec']:.1f} pages/sec")
+
+            results["ingest"] = []
+            for pdf_pages in corpus_sizes:
+                corpus_dir = os.path.join(workdir, f"corpus-{pdf_pages}")
+                pages = build_corpus(corpus_dir, pdf_pages)
+                env = child_env(ASSETS_DIR=corpus_dir, SUPPORT_BASE_URL=site_url,
+                                SNAPSHOT_DIR=os.path.join(workdir, f"kb-{pdf_pages}"), **stub_env)
+                ingest = run_child("ingest", env)
+                startup = run_child("startup", env)
+                row = {"document_pages": pages, "ingest_seconds": ingest["seconds"],
+                       "pages_per_sec": (pages + results["crawl"]["pages"]) / ingest["seconds"],
+                       "chunks": ingest["web_chunks"] + ingest["document_chunks"],
+                       "ingest_peak_rss_mb": ingest["peak_rss_mb"], "deduplication": ingest["deduplication"],
+                       "chunk_memory": ingest["chunk_memory"],
+                       "startup_seconds": startup["seconds"], "startup_peak_rss_mb": startup["peak_rss_mb"]}
+                results["ingest"].append(row)
+                print(f"corpus {pages} pages: ingest {row['ingest_seconds']:.2f}s ({row['pages_per_sec']:.1f} pages/sec), "
+                      f"{row['chunks']} chunks, peak RSS {row['ingest_peak_rss_mb']:.0f} MB; "
+                      f"startup {row['startup_seconds']:.2f}s, RSS {row['startup_peak_rss_mb']:.0f} MB")
+            dedup = results["ingest"][0]["deduplication"]
+            print(f"deduplication: {dedup['blocks']} -> {dedup['kept_blocks']} web blocks, "
+                  f"{dedup['chars']} -> {dedup['kept_chars']} characters ({dedup['reduction']:.0%} smaller)")
+            memory = results["ingest"][-1]["chunk_memory"]
+            print(f"chunk store: {memory['packed_mb']:.1f} MB for {results['ingest'][-1]['chunks']} chunks, "
+                  f"{memory['lists_mb']:.1f} MB as Python lists ({1 - memory['packed_mb'] / memory['lists_mb']:.0%} smaller)")
+
+            # Workers attaching to the largest snapshot should each add little private memory
+            results["workers"] = bench_workers(env, worker_counts)
+            for row in results["workers"]:
+                print(f"{row['workers']} workers: per worker RSS {row['rss_mb']:.0f} MB, "
+                      f"PSS {row['pss_mb']:.0f} MB, private {row['private_mb']:.0f} MB")
+
+            # Serve the answer path from the largest snapshot
+            port = free_port()
+            env["PORT"] = str(port)
+            started = time.perf_counter()
+            process = subprocess.Popen([sys.executable, "-m", "benchmarks.run", "--child", "serve"],
+                                       cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                # Cold start: the server accepts connections first and reports ready once the snapshot is loaded
+                wait_for_server(port, process, "/api/health")
+                results["cold_start"] = {"first_connection_seconds": time.perf_counter() - started}
+                wait_for_server(port, process, "/api/ready")
+                results["cold_start"]["ready_seconds"] = time.perf_counter() - started
+                print(f"cold start: accepting connections after {results['cold_start']['first_connection_seconds']:.2f}s, "
+                      f"ready after {results['cold_start']['ready_seconds']:.2f}s")
+                results["answer"] = bench_answer(port, concurrency_levels, requests_per_level)
+            finally:
+                process.terminate()
+                process.wait()
+            for row in results["answer"]:
+                print(f"answer c={row['concurrency']}: p50 {row['p50'] * 1000:.0f} ms, p95 {row['p95'] * 1000:.0f} ms, "
+                      f"p99 {row['p99'] * 1000:.0f} ms, {row['requests_per_sec']:.1f} req/s")
+        finally:
+            server.shutdown()
+
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{results['commit']}.json")
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import asyncio
+import os
+import time
+
+# Simulated Gemini latency in seconds and answer size in characters
+BENCH_LLM_LATENCY = float(os.getenv("BENCH_LLM_LATENCY", 0.5))
+BENCH_LLM_OUTPUT_CHARS = int(os.getenv("BENCH_LLM_OUTPUT_CHARS", 800))
+# Number of chunks a streamed answer is split into
+BENCH_LLM_STREAM_CHUNKS = 20
+
+
+class StubResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class StubModel:
+    """Stand-in for the Gemini model with a fixed latency and answer size; makes no network calls"""
+
+    def __init__(self, latency: float = BENCH_LLM_LATENCY, output_chars: int = BENCH_LLM_OUTPUT_CHARS):
+        self.latency = latency
+        self.output_chars = output_chars
+        self.calls = 0
+
+    def answer(self, prompt: str) -> str:
+        sentence = f"Answer based on a {len(prompt)}-character prompt. "
+        return (sentence * (self.output_chars // len(sentence) + 1))[:self.output_chars]
+
+    def generate_content(self, prompt: str, stream: bool = False):
+        self.calls += 1
+        text = self.answer(prompt)
+        if not stream:
+            time.sleep(self.latency)
+            return StubResponse(text)
+
+        def chunks():
+            size = max(1, len(text) // BENCH_LLM_STREAM_CHUNKS)
+            for start in range(0, len(text), size):
+                time.sleep(self.latency / BENCH_LLM_STREAM_CHUNKS)
+                yield StubResponse(text[start:start + size])
+        return chunks()
+
+    async def generate_content_async(self, prompt: str, stream: bool = False):
+        self.calls += 1
+        text = self.answer(prompt)
+        if not stream:
+            await asyncio.sleep(self.latency)
+            return StubResponse(text)
+        return _AsyncChunks(text, self.latency)
+
+
+class _AsyncChunks:
+    def __init__(self, text: str, latency: float):
+        self.text = text
+        self.latency = latency
+
+    async def __aiter__(self):
+        size = max(1, len(self.text) // BENCH_LLM_STREAM_CHUNKS)
+        for start in range(0, len(self.text), size):
+            await asyncio.sleep(self.latency / BENCH_LLM_STREAM_CHUNKS)
+            yield StubResponse(self.text[start:start + size])
+
+
+def install_stub_model():
+    """Replace config.model with a StubModel; must run before rag_system is imported"""
+    import config
+    config.model = StubModel()
+    return config.model
@@ -0,0 +1,271 @@
+import json
+import mmap
+import os
+from collections.abc import Sequence
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+MAGIC = b"CHUNKS01"
+ALIGNMENT = 8
+
+
+def _pad(size: int) -> int:
+    return -size % ALIGNMENT
+
+
+def save_arrays(path: str, magic: bytes, header: dict, arrays: List[Tuple[str, np.ndarray]]):
+    """Write a JSON header and named arrays to one file with a single write, through a temporary file.
+
+    Layout: magic, header length, JSON header (with a "segments" table of each array's dtype,
+    offset and size), then each array 8-byte aligned and little-endian.
+    """
+    segments, parts, position = {}, [], 0
+    for name, array in arrays:
+        array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))
+        segments[name] = [array.dtype.str, position, array.nbytes]
+        parts += [array.tobytes(), b"\0" * _pad(array.nbytes)]
+        position += array.nbytes + _pad(array.nbytes)
+    header = json.dumps(dict(header, segments=segments)).encode('utf-8')
+    header += b" " * _pad(len(magic) + 8 + len(header))
+
+    with open(path + '.tmp', 'wb') as file:
+        file.write(b"".join([magic, len(header).to_bytes(8, 'little'), header] + parts))
+    os.replace(path + '.tmp', path)
+
+
+def load_arrays(path: str, magic: bytes) -> Tuple[dict, Dict[str, np.ndarray]]:
+    """Memory-map a file written by save_arrays; the arrays are read-only views of the page cache"""
+    with open(path, 'rb') as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if data[:len(magic)] != magic:
+        raise ValueError(f"{path} is not a {magic.decode()} file")
+    header_end = len(magic) + 8 + int.from_bytes(data[len(magic):len(magic) + 8], 'little')
+    header = json.loads(data[len(magic) + 8:header_end])
+    arrays = {}
+    for name, (dtype, start, nbytes) in header["segments"].items():
+        dtype = np.dtype(dtype)
+        arrays[name] = np.frombuffer(data, dtype=dtype, count=nbytes // dtype.itemsize, offset=header_end + start)
+    return header, arrays
+
+
+class PackedStrings(Sequence):
+    """Strings stored back to back in one UTF-8 buffer, addressed by int64 offset and length arrays.
+
+    Removing strings only drops their entries; their bytes stay in the buffer until it is
+    compacted. The buffer may be shared with a copy or be a read-only memory map, so it is
+    never written in place: the first change after copying or loading packs the live strings
+    into a private buffer.
+    """
+
+    def __init__(self, buffer=None, offsets: Optional[np.ndarray] = None, lengths: Optional[np.ndarray] = None):
+        self.buffer = buffer if buffer is not None else bytearray()
+        self.offsets = offsets if offsets is not None else np.zeros(0, dtype=np.int64)
+        self.lengths = lengths if lengths is not None else np.zeros(0, dtype=np.int64)
+        self.owned = buffer is None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _position(self, index: int) -> int:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("string index out of range")
+        return index
+
+    def view(self, index: int) -> memoryview:
+        """Zero-copy UTF-8 bytes of one string; release it before adding strings to this sequence"""
+        index = self._position(index)
+        start = int(self.offsets[index])
+        return memoryview(self.buffer)[start:start + int(self.lengths[index])]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        with self.view(index) as data:
+            return str(data, 'utf-8')
+
+    def __iter__(self):
+        buffer = memoryview(self.buffer)
+        for start, length in zip(self.offsets.tolist(), self.lengths.tolist()):
+            yield str(buffer[start:start + length], 'utf-8')
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.buffer) + self.offsets.nbytes + self.lengths.nbytes
+
+    def copy(self) -> "PackedStrings":
+        """A copy sharing this buffer until either side changes"""
+        self.owned = False
+        return PackedStrings(self.buffer, self.offsets, self.lengths)
+
+    def packed(self) -> Tuple[bytes, np.ndarray]:
+        """The live strings as one contiguous buffer and their offsets, without changing this sequence"""
+        offsets = np.zeros(len(self), dtype=np.int64)
+        np.cumsum(self.lengths[:-1], out=offsets[1:])
+        live = int(self.lengths.sum())
+        if live == len(self.buffer) and np.array_equal(offsets, self.offsets):
+            return self.buffer, offsets
+        source = memoryview(self.buffer)
+        buffer = bytearray(live)
+        for start, length, target in zip(self.offsets.tolist(), self.lengths.tolist(), offsets.tolist()):
+            buffer[target:target + length] = source[start:start + length]
+        return buffer, offsets
+
+    def compact(self):
+        """Drop the bytes of removed strings, moving the rest into a private buffer"""
+        buffer, self.offsets = self.packed()
+        self.buffer = buffer if buffer is not self.buffer or self.owned else bytearray(buffer)
+        self.owned = True
+
+    def extend(self, strings: List[str]):
+        if not self.owned:
+            self.compact()
+        encoded = [text.encode('utf-8') for text in strings]
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        offsets = np.zeros(len(encoded), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=offsets[1:])
+        self.offsets = np.concatenate([self.offsets, offsets + len(self.buffer)])
+        self.lengths = np.concatenate([self.lengths, lengths])
+        self.buffer += b"".join(encoded)
+
+    def select(self, keep: np.ndarray):
+        """Keep only the strings where keep is True, compacting once most of the buffer is removed bytes"""
+        self.offsets = self.offsets[keep]
+        self.lengths = self.lengths[keep]
+        if self.owned and self.lengths.sum() * 2 < len(self.buffer):
+            self.compact()
+
+
+class Metadatas(Sequence):
+    """Metadata dicts of a ChunkStore, rebuilt from its interned sources on access"""
+
+    def __init__(self, store: "ChunkStore"):
+        self.store = store
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self.store.metadata(index)
+
+
+class ChunkStore:
+    """Chunk texts, ids and source metadata packed into a few flat arrays.
+
+    Texts share one UTF-8 buffer and ids another (see PackedStrings). A chunk's metadata is
+    split into an integer page number (-1 when it has none) and an id into a table of distinct
+    sources holding the rest of it as JSON, so the chunks of one URL or file share one entry
+    instead of each holding a dict. The whole store is saved as one file and memory-mapped
+    back without copying.
+    """
+
+    def __init__(self):
+        self.texts = PackedStrings()
+        self.ids = PackedStrings()
+        self.source_ids = np.zeros(0, dtype=np.int32)
+        self.pages = np.zeros(0, dtype=np.int32)
+        # Distinct metadata without the page: as sorted-key JSON, its position by that JSON, and as a dict
+        self.sources: List[str] = []
+        self.source_index: Dict[str, int] = {}
+        self.source_metadata: List[dict] = []
+        # Ids generated so far; never decreases, so generated ids stay unique after deletes
+        self.next_id = 0
+
+    def __len__(self):
+        return len(self.texts)
+
+    @property
+    def metadatas(self) -> Metadatas:
+        return Metadatas(self)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the texts, ids and per-chunk arrays"""
+        return self.texts.nbytes + self.ids.nbytes + self.source_ids.nbytes + self.pages.nbytes
+
+    def copy(self) -> "ChunkStore":
+        """A copy that can be changed without affecting readers of this one; buffers are shared until then"""
+        clone = ChunkStore()
+        clone.texts = self.texts.copy()
+        clone.ids = self.ids.copy()
+        clone.source_ids = self.source_ids
+        clone.pages = self.pages
+        clone.sources = list(self.sources)
+        clone.source_index = dict(self.source_index)
+        clone.source_metadata = list(self.source_metadata)
+        clone.next_id = self.next_id
+        return clone
+
+    def new_ids(self, count: int) -> List[str]:
+        """Ids for chunks added without one: "doc_<n>" with n never reused, even after deletes"""
+        start, self.next_id = self.next_id, self.next_id + count
+        return [f"doc_{i}" for i in range(start, start + count)]
+
+    def _intern(self, metadata: dict) -> Tuple[int, int]:
+        page = metadata.get("page")
+        if isinstance(page, int) and page >= 0:
+            metadata = {key: value for key, value in metadata.items() if key != "page"}
+        else:
+            metadata, page = dict(metadata), -1
+        key = json.dumps(metadata, sort_keys=True)
+        source_id = self.source_index.get(key)
+        if source_id is None:
+            source_id = self.source_index[key] = len(self.sources)
+            self.sources.append(key)
+            self.source_metadata.append(metadata)
+        return source_id, page
+
+    def metadata(self, index: int) -> dict:
+        index = self.texts._position(index)
+        metadata = dict(self.source_metadata[self.source_ids[index]])
+        if self.pages[index] >= 0:
+            metadata["page"] = int(self.pages[index])
+        return metadata
+
+    def add(self, documents: List[str], ids: List[str], metadatas: List[dict]):
+        interned = [self._intern(metadata) for metadata in metadatas]
+        self.texts.extend(documents)
+        self.ids.extend(ids)
+        self.source_ids = np.concatenate([self.source_ids, np.array([source for source, _ in interned], dtype=np.int32)])
+        self.pages = np.concatenate([self.pages, np.array([page for _, page in interned], dtype=np.int32)])
+
+    def delete(self, ids) -> np.ndarray:
+        """Remove chunks by id and return the keep mask over the previous positions"""
+        doomed = set(ids)
+        keep = np.fromiter((doc_id not in doomed for doc_id in self.ids), dtype=bool, count=len(self))
+        if not keep.all():
+            self.texts.select(keep)
+            self.ids.select(keep)
+            self.source_ids = self.source_ids[keep]
+            self.pages = self.pages[keep]
+        return keep
+
+    def save(self, path: str):
+        """Write the store to one file (see save_arrays). Only live text and sources still referenced are written."""
+        texts, text_offsets = self.texts.packed()
+        ids, id_offsets = self.ids.packed()
+        used, source_ids = np.unique(self.source_ids, return_inverse=True)
+        arrays = [("text_offsets", text_offsets), ("text_lengths", self.texts.lengths),
+                  ("id_offsets", id_offsets), ("id_lengths", self.ids.lengths),
+                  ("source_ids", source_ids.astype(np.int32)), ("pages", self.pages),
+                  ("texts", np.frombuffer(texts, dtype=np.uint8)), ("ids", np.frombuffer(ids, dtype=np.uint8))]
+        save_arrays(path, MAGIC, {"count": len(self), "next_id": self.next_id,
+                                  "sources": [self.sources[i] for i in used.tolist()]}, arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "ChunkStore":
+        """Memory-map a saved store; texts and ids are decoded from the page cache on access"""
+        header, arrays = load_arrays(path, MAGIC)
+        store = cls()
+        store.texts = PackedStrings(memoryview(arrays["texts"]), arrays["text_offsets"], arrays["text_lengths"])
+        store.ids = PackedStrings(memoryview(arrays["ids"]), arrays["id_offsets"], arrays["id_lengths"])
+        store.source_ids = arrays["source_ids"]
+        store.pages = arrays["pages"]
+        store.sources = header["sources"]
+        store.source_index = {key: source_id for source_id, key in enumerate(store.sources)}
+        store.source_metadata = [json.loads(key) for key in store.sources]
+        store.next_id = header["next_id"]
+        return store
@@ -0,0 +1,118 @@
+import os
+import re
+from typing import Iterable, List
+
+# Target chunk size and how much trailing text each chunk repeats from the previous one, in characters
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 1000))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 150))
+
+# Markdown headings, numbered section titles, or short all-caps lines such as "MEDICAL EVENTS"
+HEADING_PATTERN = re.compile(r"^(#{1,6}\s+\S.*|\d+(\.\d+)*\s+[A-Z][^.!?]{0,80}|[A-Z0-9][A-Z0-9 &/,:()'\-]{2,80})$")
+# A sentence ends at ., ! or ? followed by whitespace and an uppercase letter, digit or quote
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(])")
+WORD_BOUNDARY = re.compile(r"\s+")
+
+
+def split_blocks(text: str) -> List[str]:
+    """Split text into paragraphs, starting a new block at every heading.
+
+    Lines inside a paragraph stay on separate lines, so table rows are kept intact.
+    """
+    blocks = []
+    current: List[str] = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            if current:
+                blocks.append("\n".join(current))
+                current = []
+            continue
+        if HEADING_PATTERN.match(stripped) and current:
+            blocks.append("\n".join(current))
+            current = []
+        current.append(stripped)
+    if current:
+        blocks.append("\n".join(current))
+    return blocks
+
+
+def split_oversized(block: str, size: int) -> List[str]:
+    """Split a block longer than size at sentence boundaries, falling back to word boundaries.
+
+    A single word longer than size (a long URL, a table run without spaces) is cut every size characters.
+    """
+    pieces = []
+    for sentence in SENTENCE_BOUNDARY.split(block):
+        if len(sentence) <= size:
+            pieces.append(sentence)
+            continue
+        words: List[str] = []
+        length = 0
+        for word in sentence.split():
+            if len(word) > size:
+                if words:
+                    pieces.append(" ".join(words))
+                    words, length = [], 0
+                pieces.extend(word[start:start + size] for start in range(0, len(word), size))
+                continue
+            if words and length + len(word) + 1 > size:
+                pieces.append(" ".join(words))
+                words, length = [], 0
+            words.append(word)
+            length += len(word) + 1
+        if words:
+            pieces.append(" ".join(words))
+    return pieces
+
+
+def trailing_text(piece: str, limit: int) -> str:
+    """The longest run of whole trailing sentences of piece within limit characters, or else of whole words"""
+    for boundary in (SENTENCE_BOUNDARY, WORD_BOUNDARY):
+        for match in boundary.finditer(piece):
+            if len(piece) - match.end() <= limit:
+                return piece[match.end():]
+    return ""
+
+
+def chunk_text(text: str, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """Pack paragraphs, headings and sentences into chunks of at most size characters.
+
+    Chunks only break between pieces, never inside a word shorter than size, and each chunk
+    starts with up to overlap characters from the end of the previous chunk: whole trailing
+    pieces, then the trailing sentences or words of the piece before them.
+    """
+    # Oversized blocks are split small enough that each piece still fits after the carried overlap
+    piece_size = max(size - overlap, size // 2)
+    pieces: Iterable[str] = (
+        piece
+        for block in split_blocks(text)
+        for piece in ([block] if len(block) <= size else split_oversized(block, piece_size))
+    )
+
+    chunks = []
+    current: List[str] = []
+    length = 0
+    for piece in pieces:
+        if current and length + len(piece) > size:
+            chunks.append("\n".join(current))
+            # Carry trailing pieces into the next chunk, as long as they fit the overlap,
+            # and the end of the first piece that doesn't
+            carry: List[str] = []
+            carried = 0
+            for previous in reversed(current):
+                if carried + len(previous) + 1 > overlap:
+                    tail = trailing_text(previous, overlap - carried - 1)
+                    if tail:
+                        carry.insert(0, tail)
+                        carried += len(tail) + 1
+                    break
+                carry.insert(0, previous)
+                carried += len(previous) + 1
+            if carried + len(piece) > size:
+                carry, carried = [], 0
+            current, length = carry, carried
+        current.append(piece)
+        length += len(piece) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
@@ -1,55 +1,134 @@
 import os
+import threading
 from dotenv import load_dotenv
-import google.generativeai as genai
 from typing import List
+import numpy as np
+from chunk_store import ChunkStore
+from retrieval import BM25Index
+from vector_store import VectorStore, get_embedder
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Gemini
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-model = genai.GenerativeModel('gemini-2.0-flash')
+# Gemini model, created by get_model() on first use; importing google.generativeai takes about a second
+model = None
+_model_lock = threading.Lock()
 
-# Store the model name as a string instead of initializing SentenceTransformer
-sentence_transformer_model = 'all-MiniLM-L6-v2'
+def get_model():
+    """Configure Gemini and return the shared model, creating it on first use"""
+    global model
+    with _model_lock:
+        if model is None:
+            import google.generativeai as genai
+            genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+            model = genai.GenerativeModel('gemini-2.0-flash')
+        return model
 
-# Store documents as a string instead of using ChromaDB collection
-documents_data = ""
+# Embedding model used for semantic retrieval when sentence-transformers is installed locally
+sentence_transformer_model = os.getenv("EMBEDDING_MODEL", 'all-MiniLM-L6-v2')
 
-# Store collection documents as a list of strings
-collection_documents = []
+# "semantic" ranks chunks with embeddings in a VectorStore, "bm25" with the lexical MockCollection index
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "semantic")
+# Store embeddings as int8 instead of float32 (4x smaller, slightly less precise)
+QUANTIZE_EMBEDDINGS = os.getenv("QUANTIZE_EMBEDDINGS", "false").lower() == "true"
+# Directory holding the knowledge-base snapshot (chunks, source metadata and indexes) written after ingestion
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(os.path.dirname(__file__), 'data', 'kb'))
 
-# Function to add documents to the collection_documents list
-def add_to_collection(documents, ids=None):
-    """Add documents to the collection_documents list"""
-    global collection_documents
-    collection_documents.extend(documents)
-    return {"count": len(collection_documents)}
+# Retrieval settings: how many chunks to consider per source; PROMPT_TOKEN_BUDGET limits how many reach the prompt
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 8))
+
+# Function to add documents to the web collection
+def add_to_collection(documents, ids=None, metadatas=None):
+    """Add documents to the web collection"""
+    return collection.add(documents, ids, metadatas)
 
 # Create a mock collection object with the necessary methods
 class MockCollection:
+    CHUNKS_FILE = "chunks.bin"
+    INDEX_FILE = "bm25.bin"
+
     def __init__(self):
-        pass
-        
+        # Texts, ids and source metadata (e.g. {"source": "plan.pdf", "page": 2}) in index order
+        self.chunks = ChunkStore()
+        # BM25 index over the chunk texts, built as documents are ingested
+        self.index = BM25Index()
+
+    @property
+    def documents(self):
+        return self.chunks.texts
+
+    @property
+    def ids(self):
+        return self.chunks.ids
+
+    @property
+    def metadatas(self):
+        return self.chunks.metadatas
+
     def count(self):
         """Return the number of documents in the collection"""
-        return len(collection_documents)
+        return len(self.chunks)
+
+    def empty(self):
+        """Return a new empty collection"""
+        return MockCollection()
+
+    def copy(self):
+        """Return a copy that can be changed without affecting readers of this one"""
+        clone = MockCollection()
+        clone.chunks = self.chunks.copy()
+        clone.index = self.index.copy()
+        return clone
         
-    def add(self, documents, ids=None):
+    def add(self, documents, ids=None, metadatas=None):
         """Add documents to the collection"""
-        return add_to_collection(documents, ids)
+        self.chunks.add(documents, ids or self.chunks.new_ids(len(documents)), metadatas or [{} for _ in documents])
+        self.index.add(documents)
+        return {"count": len(self.chunks)}
+
+    def delete(self, ids):
+        """Remove documents by id"""
+        keep = self.chunks.delete(ids)
+        self.index.remove(np.flatnonzero(~keep).tolist())
         
     def get(self):
         """Query the collection"""
         return {
-            "documents": [collection_documents] if collection_documents else [[]]
+            "documents": [self.documents] if self.documents else [[]]
         }
 
-# Create a mock collection object
-collection = MockCollection()
+    def query(self, text, k=RETRIEVAL_TOP_K):
+        """Return the k documents that best match the text, best first"""
+        hits = self.index.search(text, k)
+        return {
+            "ids": [[self.ids[position] for position, _ in hits]],
+            "documents": [[self.documents[position] for position, _ in hits]],
+            "metadatas": [[self.metadatas[position] for position, _ in hits]],
+            "scores": [[score for _, score in hits]]
+        }
+
+    def save(self, directory):
+        """Write the documents as a chunk store file and their BM25 index as flat arrays"""
+        os.makedirs(directory, exist_ok=True)
+        self.chunks.save(os.path.join(directory, self.CHUNKS_FILE))
+        self.index.save(os.path.join(directory, self.INDEX_FILE))
+
+    def load(self, directory):
+        """Memory-map saved documents and index; returns False when nothing is saved there"""
+        chunks_path = os.path.join(directory, self.CHUNKS_FILE)
+        index_path = os.path.join(directory, self.INDEX_FILE)
+        if not os.path.exists(chunks_path) or not os.path.exists(index_path):
+            return False
+        self.index = BM25Index.load(index_path)
+        self.chunks = ChunkStore.load(chunks_path)
+        return True
+
+# Create the collection for web-scraped documents and a separate one for local documents from the assets folder
+if RETRIEVAL_BACKEND == "bm25":
+    collection = MockCollection()
+    document_collection = MockCollection()
+else:
+    embedder = get_embedder(sentence_transformer_model)
+    collection = VectorStore(embedder, quantize=QUANTIZE_EMBEDDINGS)
+    document_collection = VectorStore(embedder, quantize=QUANTIZE_EMBEDDINGS)
 
-# Function to update documents_data
-def update_documents_data(new_data):
-    """Update the documents_data variable with new data"""
-    global documents_data
-    documents_data = new_data
\ No newline at end of file
@@ -0,0 +1,222 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+
+# "memory" keeps sessions per process; "sqlite" shares them between workers through CONVERSATION_DB
+CONVERSATION_BACKEND = os.getenv("CONVERSATION_BACKEND", "memory")
+CONVERSATION_DB = os.getenv("CONVERSATION_DB", os.path.join(os.path.dirname(__file__), 'data', 'conversations.db'))
+# Session limits: how many are kept, how long an idle one lives, and how many messages each keeps
+MAX_CONVERSATIONS = int(os.getenv("MAX_CONVERSATIONS", 10000))
+CONVERSATION_TTL = float(os.getenv("CONVERSATION_TTL", 3600))
+MAX_CONVERSATION_MESSAGES = int(os.getenv("MAX_CONVERSATION_MESSAGES", 40))
+# Token budget for the conversation history included in a prompt
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 1000))
+
+
+class Message(NamedTuple):
+    """One conversation turn; a tuple, so much smaller than a dict per message"""
+    role: str
+    content: str
+
+
+class ConversationStore:
+    """In-process conversation store with LRU eviction, idle expiry and a cap on sessions"""
+
+    def __init__(self, max_conversations: int = MAX_CONVERSATIONS, ttl: float = CONVERSATION_TTL,
+                 max_messages: int = MAX_CONVERSATION_MESSAGES):
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self.max_messages = max_messages
+        # conversation id -> (last access time, messages), least recently used first
+        self.sessions: "OrderedDict[str, Tuple[float, List[Message]]]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.sessions)
+
+    def __contains__(self, conversation_id):
+        return self.get(conversation_id) is not None
+
+    def get(self, conversation_id: Optional[str]) -> Optional[List[Message]]:
+        """Return a copy of a live conversation's messages, or None"""
+        if not conversation_id:
+            return None
+        now = time.monotonic()
+        with self.lock:
+            session = self.sessions.get(conversation_id)
+            if session is None:
+                return None
+            if session[0] + self.ttl <= now:
+                del self.sessions[conversation_id]
+                return None
+            self.sessions[conversation_id] = (now, session[1])
+            self.sessions.move_to_end(conversation_id)
+            return list(session[1])
+
+    def get_or_create(self, conversation_id: Optional[str] = None) -> Tuple[str, List[Message]]:
+        """Get an existing conversation or create a new one"""
+        messages = self.get(conversation_id)
+        if messages is not None:
+            return conversation_id, messages
+
+        # Create a new conversation ID
+        new_id = str(uuid.uuid4())
+        now = time.monotonic()
+        with self.lock:
+            self.sessions[new_id] = (now, [])
+            self._evict(now)
+        return new_id, []
+
+    def append(self, conversation_id: str, *messages: Message) -> bool:
+        """Add messages to a conversation; returns False when it no longer exists"""
+        now = time.monotonic()
+        with self.lock:
+            session = self.sessions.get(conversation_id)
+            if session is None:
+                return False
+            stored = session[1]
+            stored.extend(messages)
+            # Older turns can never fit the prompt window, so don't keep them around
+            del stored[:-self.max_messages]
+            self.sessions[conversation_id] = (now, stored)
+            self.sessions.move_to_end(conversation_id)
+            return True
+
+    def delete(self, conversation_id: str) -> bool:
+        """Remove a conversation; returns False when it did not exist"""
+        with self.lock:
+            return self.sessions.pop(conversation_id, None) is not None
+
+    def _evict(self, now: float):
+        # Least recently used sessions are at the front, so expired ones are too
+        while self.sessions:
+            oldest_id, (last_access, _) = next(iter(self.sessions.items()))
+            if len(self.sessions) <= self.max_conversations and last_access + self.ttl > now:
+                break
+            del self.sessions[oldest_id]
+
+
+class SQLiteConversationStore:
+    """Conversation store in a SQLite database, so several worker processes share sessions"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS conversations (id TEXT PRIMARY KEY, last_access REAL NOT NULL);
+    CREATE INDEX IF NOT EXISTS conversations_last_access ON conversations (last_access);
+    CREATE TABLE IF NOT EXISTS messages (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        conversation_id TEXT NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS messages_conversation ON messages (conversation_id, seq);
+    """
+
+    def __init__(self, path: str = CONVERSATION_DB, max_conversations: int = MAX_CONVERSATIONS,
+                 ttl: float = CONVERSATION_TTL, max_messages: int = MAX_CONVERSATION_MESSAGES):
+        self.path = path
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self.max_messages = max_messages
+        # One connection per thread; sqlite3 connections must not be shared across threads
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connection() as connection:
+            connection.executescript(self.SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            # WAL lets readers in other workers proceed while one worker writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def __len__(self):
+        cutoff = time.time() - self.ttl
+        row = self._connection().execute(
+            "SELECT COUNT(*) FROM conversations WHERE last_access > ?", (cutoff,)
+        ).fetchone()
+        return row[0]
+
+    def __contains__(self, conversation_id):
+        return self.get(conversation_id) is not None
+
+    def get(self, conversation_id: Optional[str]) -> Optional[List[Message]]:
+        """Return a live conversation's messages, or None"""
+        if not conversation_id:
+            return None
+        now = time.time()
+        with self._connection() as connection:
+            touched = connection.execute(
+                "UPDATE conversations SET last_access = ? WHERE id = ? AND last_access > ?",
+                (now, conversation_id, now - self.ttl)
+            ).rowcount
+            if not touched:
+                return None
+            rows = connection.execute(
+                "SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY seq DESC LIMIT ?",
+                (conversation_id, self.max_messages)
+            ).fetchall()
+        return [Message(role, content) for role, content in reversed(rows)]
+
+    def get_or_create(self, conversation_id: Optional[str] = None) -> Tuple[str, List[Message]]:
+        """Get an existing conversation or create a new one"""
+        messages = self.get(conversation_id)
+        if messages is not None:
+            return conversation_id, messages
+
+        new_id = str(uuid.uuid4())
+        now = time.time()
+        with self._connection() as connection:
+            connection.execute("INSERT INTO conversations (id, last_access) VALUES (?, ?)", (new_id, now))
+            self._evict(connection, now)
+        return new_id, []
+
+    def append(self, conversation_id: str, *messages: Message) -> bool:
+        """Add messages to a conversation; returns False when it no longer exists"""
+        with self._connection() as connection:
+            touched = connection.execute(
+                "UPDATE conversations SET last_access = ? WHERE id = ?", (time.time(), conversation_id)
+            ).rowcount
+            if not touched:
+                return False
+            connection.executemany(
+                "INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)",
+                [(conversation_id, message.role, message.content) for message in messages]
+            )
+            connection.execute(
+                "DELETE FROM messages WHERE conversation_id = ? AND seq NOT IN "
+                "(SELECT seq FROM messages WHERE conversation_id = ? ORDER BY seq DESC LIMIT ?)",
+                (conversation_id, conversation_id, self.max_messages)
+            )
+        return True
+
+    def delete(self, conversation_id: str) -> bool:
+        """Remove a conversation; returns False when it did not exist"""
+        with self._connection() as connection:
+            connection.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+            return connection.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,)).rowcount > 0
+
+    def _evict(self, connection: sqlite3.Connection, now: float):
+        """Delete expired sessions and the least recently used ones beyond the cap"""
+        doomed = [(row[0],) for row in connection.execute(
+            "SELECT id FROM conversations WHERE last_access <= ? UNION "
+            "SELECT id FROM (SELECT id FROM conversations ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (now - self.ttl, self.max_conversations)
+        )]
+        connection.executemany("DELETE FROM messages WHERE conversation_id = ?", doomed)
+        connection.executemany("DELETE FROM conversations WHERE id = ?", doomed)
+
+
+def create_conversation_store():
+    """Build the conversation store selected by CONVERSATION_BACKEND"""
+    if CONVERSATION_BACKEND == "sqlite":
+        return SQLiteConversationStore()
+    return ConversationStore()
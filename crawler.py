@@ -0,0 +1,180 @@
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+from urllib.parse import urljoin, urlsplit, urlunsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from metrics import CRAWL_BYTES, CRAWL_PAGES
+
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+
+# Crawl settings: total worker threads, parallel requests and requests/sec allowed per host
+CRAWL_MAX_WORKERS = int(os.getenv("CRAWL_MAX_WORKERS", 16))
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", 4))
+CRAWL_RATE_LIMIT = float(os.getenv("CRAWL_RATE_LIMIT", 4))
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a URL so the same page is only fetched once.
+
+    Lowercases the scheme and host, and drops the fragment, the query string and any trailing slash.
+    """
+    parts = urlsplit(url.strip())
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, '', ''))
+
+
+def extract_links(soup: 'BeautifulSoup', url: str, path_filter: str = '/support') -> List[str]:
+    """Extract normalized same-host links whose path contains path_filter"""
+    host = urlsplit(url).netloc.lower()
+    sub_pages = set()
+    for link in soup.find_all('a', href=True):
+        # Resolves relative links against the page they appear on
+        href = normalize_url(urljoin(url, link['href']))
+        parts = urlsplit(href)
+        if parts.scheme in ('http', 'https') and parts.netloc == host and path_filter in parts.path:
+            sub_pages.add(href)
+    return sorted(sub_pages)
+
+
+class HostRateLimiter:
+    """Spaces out requests to each host so no host sees more than rate requests per second"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_slot: Dict[str, float] = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def wait(self, host: str):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot[host])
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Crawler:
+    """Breadth-first crawler that fetches pages concurrently through one pooled session.
+
+    Every URL is normalized and fetched at most once, and its text and links are parsed
+    from the same soup.
+    """
+
+    def __init__(self, extract_text: Callable[['BeautifulSoup'], List[str]], timeout: float = 20,
+                 max_workers: int = CRAWL_MAX_WORKERS, concurrency: int = CRAWL_CONCURRENCY,
+                 rate_limit: float = CRAWL_RATE_LIMIT, path_filter: str = '/support'):
+        self.extract_text = extract_text
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.path_filter = path_filter
+        self.rate_limiter = HostRateLimiter(rate_limit)
+        self.host_slots = defaultdict(lambda: threading.BoundedSemaphore(concurrency))
+        self.host_slots_lock = threading.Lock()
+
+        self.session = requests.Session()
+        retries = Retry(total=2, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504], allowed_methods=['GET'])
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retries)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.stats = {"pages_fetched": 0, "pages_not_modified": 0, "pages_failed": 0,
+                      "bytes_downloaded": 0, "seconds": 0.0, "pages_per_sec": 0.0}
+
+    def crawl(self, base_url: str, max_levels: int, previous_pages: Optional[Dict[str, Dict]] = None,
+              on_progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, Dict]:
+        """Crawl from base_url up to max_levels links deep.
+
+        Returns {normalized url: page} where page has "chunks" (None when the server says the
+        page is unchanged since previous_pages), "links", "etag" and "last_modified".
+        on_progress is called with (pages crawled, level) after each level.
+        """
+        previous_pages = previous_pages or {}
+        pages: Dict[str, Dict] = {}
+        visited = set()
+        started = time.perf_counter()
+
+        # Level 0 is the base page itself
+        urls_to_visit = [normalize_url(base_url)]
+        current_level = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while urls_to_visit and current_level <= max_levels:
+                print(f"Scraping level {current_level} with {len(urls_to_visit)} URLs to visit")
+                visited.update(urls_to_visit)
+                results = executor.map(lambda url: (url, self.fetch(url, previous_pages.get(url, {}))), urls_to_visit)
+
+                next_urls = set()
+                for url, page in results:
+                    if page is None:
+                        continue
+                    pages[url] = page
+                    next_urls.update(link for link in page["links"] if link not in visited)
+
+                urls_to_visit = sorted(next_urls)
+                if on_progress:
+                    on_progress(len(pages), current_level)
+                current_level += 1
+
+        self.stats["seconds"] = time.perf_counter() - started
+        fetched = self.stats["pages_fetched"] + self.stats["pages_not_modified"]
+        self.stats["pages_per_sec"] = fetched / self.stats["seconds"] if self.stats["seconds"] else 0.0
+        print(f"Scraped a total of {len(pages)} pages across {current_level} levels "
+              f"in {self.stats['seconds']:.1f}s ({self.stats['pages_per_sec']:.1f} pages/sec, "
+              f"{self.stats['pages_failed']} failed, {self.stats['bytes_downloaded']} bytes)")
+        return pages
+
+    def fetch(self, url: str, previous: Dict) -> Optional[Dict]:
+        """Fetch and parse one page; returns None when it could not be fetched"""
+        host = urlsplit(url).netloc
+        with self.host_slots_lock:
+            slot = self.host_slots[host]
+
+        headers = {}
+        if previous.get('etag'):
+            headers['If-None-Match'] = previous['etag']
+        if previous.get('last_modified'):
+            headers['If-Modified-Since'] = previous['last_modified']
+
+        try:
+            with slot:
+                self.rate_limiter.wait(host)
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+        except Exception as e:
+            print(f"Error scraping page {url}: {e}")
+            self._count("pages_failed")
+            CRAWL_PAGES.inc(result="failed")
+            return None
+
+        if response.status_code == 304 and previous:
+            # Unchanged: keep the stored chunks and follow the stored links
+            self._count("pages_not_modified")
+            CRAWL_PAGES.inc(result="not_modified")
+            return {"chunks": None, "links": previous.get('links', []),
+                    "etag": previous.get('etag'), "last_modified": previous.get('last_modified')}
+        if not response.ok:
+            print(f"Error scraping page {url}: HTTP {response.status_code}")
+            self._count("pages_failed")
+            CRAWL_PAGES.inc(result="failed")
+            return None
+
+        self._count("pages_fetched")
+        self._count("bytes_downloaded", len(response.content))
+        CRAWL_PAGES.inc(result="fetched")
+        CRAWL_BYTES.inc(len(response.content))
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(response.text, 'html.parser')
+        return {"chunks": self.extract_text(soup),
+                "links": extract_links(soup, url, self.path_filter),
+                "etag": response.headers.get('ETag'),
+                "last_modified": response.headers.get('Last-Modified')}
+
+    def _count(self, name: str, amount: int = 1):
+        with self.host_slots_lock:
+            self.stats[name] += amount
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,168 @@
+import hashlib
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+
+# Pages whose estimated Jaccard similarity (over word shingles) reaches this are near-duplicates
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", 0.8))
+# A text block found on at least this fraction of crawled pages (and on 3 or more) is boilerplate
+BOILERPLATE_PAGE_FRACTION = float(os.getenv("BOILERPLATE_PAGE_FRACTION", 0.5))
+BOILERPLATE_MIN_PAGES = 3
+
+SHINGLE_SIZE = 5
+MINHASH_PERMUTATIONS = 64
+# 16 bands of 4 rows: pages at the threshold almost always share a band, unrelated pages rarely do
+LSH_BANDS = 16
+
+WHITESPACE = re.compile(r"\s+")
+
+_rng = np.random.default_rng(20240601)
+# Odd multipliers and offsets of the multiply-shift hash family used for the permutations
+_MULTIPLIERS = _rng.integers(1, 2 ** 63, MINHASH_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+_OFFSETS = _rng.integers(0, 2 ** 63, MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+def normalize(text: str) -> str:
+    """Lowercase and collapse whitespace, so formatting differences don't defeat hashing"""
+    return WHITESPACE.sub(" ", text).strip().lower()
+
+
+def block_hash(text: str) -> str:
+    """64-bit hex digest of a normalized text block"""
+    return hashlib.blake2b(normalize(text).encode('utf-8'), digest_size=8).hexdigest()
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    """64-bit hashes of the distinct word shingles of the text"""
+    words = normalize(text).split()
+    grams = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+    return np.array([int.from_bytes(hashlib.blake2b(gram.encode('utf-8'), digest_size=8).digest(), 'little')
+                     for gram in grams], dtype=np.uint64)
+
+
+def minhash(text: str) -> np.ndarray:
+    """MinHash signature: for each permutation, the smallest hashed shingle"""
+    hashes = shingles(text)
+    if hashes.size == 0:
+        return np.full(MINHASH_PERMUTATIONS, np.iinfo(np.uint32).max, dtype=np.uint32)
+    # (permutations, shingles); uint64 arithmetic wraps, and the top 32 bits are the permuted value
+    with np.errstate(over='ignore'):
+        permuted = (_MULTIPLIERS[:, None] * hashes[None, :] + _OFFSETS[:, None]) >> np.uint64(32)
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of the texts behind two signatures"""
+    return float(np.mean(a == b))
+
+
+def signature_to_hex(signature: np.ndarray) -> str:
+    return signature.astype('<u4').tobytes().hex()
+
+
+def signature_from_hex(value: str) -> np.ndarray:
+    return np.frombuffer(bytes.fromhex(value), dtype='<u4').astype(np.uint32)
+
+
+class MinHashIndex:
+    """Locality-sensitive hashing over MinHash signatures to find near-duplicates without comparing every pair"""
+
+    def __init__(self, threshold: float = NEAR_DUPLICATE_THRESHOLD, bands: int = LSH_BANDS):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = MINHASH_PERMUTATIONS // bands
+        self.buckets: Dict[Tuple[int, bytes], List[str]] = defaultdict(list)
+        self.signatures: Dict[str, np.ndarray] = {}
+
+    def _band_keys(self, signature: np.ndarray) -> Iterable[Tuple[int, bytes]]:
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def add(self, key: str, signature: np.ndarray):
+        self.signatures[key] = signature
+        for band_key in self._band_keys(signature):
+            self.buckets[band_key].append(key)
+
+    def find(self, signature: np.ndarray) -> Optional[str]:
+        """Return the most similar indexed key at or above the threshold, if any"""
+        candidates = {key for band_key in self._band_keys(signature) for key in self.buckets.get(band_key, ())}
+        best, best_score = None, self.threshold
+        for key in sorted(candidates):
+            score = similarity(signature, self.signatures[key])
+            if score >= best_score:
+                best, best_score = key, score
+        return best
+
+
+def find_boilerplate(page_hashes: Dict[str, List[str]], fraction: float = BOILERPLATE_PAGE_FRACTION) -> Set[str]:
+    """Hashes of blocks that repeat on so many pages that they are site chrome rather than content"""
+    counts = Counter(digest for hashes in page_hashes.values() for digest in set(hashes))
+    min_pages = max(BOILERPLATE_MIN_PAGES, fraction * len(page_hashes))
+    return {digest for digest, count in counts.items() if count >= min_pages}
+
+
+class Deduplicator:
+    """Drops boilerplate, exact duplicate blocks and near-duplicate pages from a crawl.
+
+    Pages are registered or filtered in a fixed order; the first page to contain a block or
+    a near-duplicate text keeps it.
+    """
+
+    def __init__(self, boilerplate: Set[str], threshold: float = NEAR_DUPLICATE_THRESHOLD):
+        self.boilerplate = boilerplate
+        self.index = MinHashIndex(threshold)
+        # block hash -> page that kept it
+        self.owners: Dict[str, str] = {}
+        self.stats = {"blocks": 0, "chars": 0, "kept_blocks": 0, "kept_chars": 0,
+                      "boilerplate": 0, "duplicate": 0, "near_duplicate_pages": 0}
+
+    def register(self, url: str, kept_hashes: List[str], signature: Optional[np.ndarray]):
+        """Record a page whose blocks are already stored, e.g. because it is unchanged since the last crawl"""
+        for digest in kept_hashes:
+            self.owners.setdefault(digest, url)
+        if signature is not None:
+            self.index.add(url, signature)
+
+    def filter_page(self, url: str, blocks: List[str], hashes: Optional[List[str]] = None) -> Dict:
+        """Return the page's remaining blocks and their hashes, its signature, and the page it duplicates, if any"""
+        hashes = hashes if hashes is not None else [block_hash(block) for block in blocks]
+        self.stats["blocks"] += len(blocks)
+        self.stats["chars"] += sum(map(len, blocks))
+
+        content = []
+        for block, digest in zip(blocks, hashes):
+            if digest in self.boilerplate:
+                self.stats["boilerplate"] += 1
+            else:
+                content.append((block, digest))
+
+        # Near-duplicates are judged on the whole page, before its repeated blocks are dropped
+        signature = minhash("\n".join(block for block, _ in content)) if content else None
+        duplicate_of = self.index.find(signature) if signature is not None else None
+        if duplicate_of:
+            self.stats["near_duplicate_pages"] += 1
+            self.stats["duplicate"] += len(content)
+            content = []
+        elif signature is not None:
+            self.index.add(url, signature)
+
+        unique = []
+        for block, digest in content:
+            if self.owners.setdefault(digest, url) != url or digest in (kept for _, kept in unique):
+                self.stats["duplicate"] += 1
+            else:
+                unique.append((block, digest))
+        content = unique
+
+        self.stats["kept_blocks"] += len(content)
+        self.stats["kept_chars"] += sum(len(block) for block, _ in content)
+        return {"blocks": [block for block, _ in content], "block_hashes": hashes,
+                "kept_hashes": [digest for _, digest in content],
+                "signature": signature, "duplicate_of": duplicate_of}
+
+    def report(self) -> Dict:
+        """Stats plus the share of crawled characters removed"""
+        removed = 1 - self.stats["kept_chars"] / self.stats["chars"] if self.stats["chars"] else 0.0
+        return dict(self.stats, reduction=round(removed, 4))
@@ -1,60 +1,115 @@
+import multiprocessing
 import os
-import requests
-from bs4 import BeautifulSoup
-import PyPDF2
-from typing import List
-from config import collection, update_documents_data
 import time
-import docx
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Tuple
+from chunking import chunk_text
+from crawler import Crawler
+from metrics import FALLBACKS
 from dotenv import load_dotenv
 
+# PyPDF2, python-docx and BeautifulSoup are imported where they are used, so starting
+# the server from a saved snapshot doesn't pay for them
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+
 # Load environment variables
 load_dotenv()
 
+# Root page of the support site to crawl
+BASE_URL = os.getenv("SUPPORT_BASE_URL", "https://www.angelone.in/support")
+# Folder of PDF, TXT and DOCX files to ingest
+ASSETS_DIR = os.getenv("ASSETS_DIR", os.path.join(os.path.dirname(__file__), 'assets'))
+# Seconds to wait for a page before giving up on it
+REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", 20))
+# Processes used to parse documents, and how many PDF pages each parsing task covers
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", 8))
+
+# Elements whose text becomes a block; only the innermost ones are kept so nested text isn't repeated
+BLOCK_TAGS = ['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li', 'td', 'article', 'section']
+# Site chrome and non-text elements whose contents are never blocks
+SKIPPED_TAGS = ['nav', 'footer', 'script', 'style', 'noscript']
+
 class DocumentProcessor:
     @staticmethod
-    def extract_text_from_pdf(pdf_path: str) -> str:
-        """Extract text from a PDF file"""
-        try:
-            with open(pdf_path, 'rb') as file:
-                reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in reader.pages:
-                    text += page.extract_text() + "\n"
-                return text
-        except Exception as e:
-            print(f"Error reading PDF {pdf_path}: {e}")
-            return ""
+    def iter_pdf_pages(pdf_path: str, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        """Yield (page number, text) for pages start..end of a PDF, one page at a time"""
+        import PyPDF2
+        with open(pdf_path, 'rb') as file:
+            reader = PyPDF2.PdfReader(file)
+            pages = reader.pages
+            for index in range(start, min(end if end is not None else len(pages), len(pages))):
+                yield index + 1, pages[index].extract_text() or ""
+
+    @staticmethod
+    def iter_pages(file_path: str, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        """Yield (page number, text) for a PDF, TXT or DOCX file; TXT and DOCX are a single page"""
+        file_extension = os.path.splitext(file_path)[1].lower()
+        
+        # Process based on file extension
+        if file_extension == '.pdf':
+            yield from DocumentProcessor.iter_pdf_pages(file_path, start, end)
+        elif file_extension == '.txt':
+            yield 1, DocumentProcessor.extract_text_from_txt(file_path)
+        elif file_extension == '.docx':
+            yield 1, DocumentProcessor.extract_text_from_docx(file_path)
 
     @staticmethod
-    def process_documents() -> List[str]:
-        """Process documents from the assets folder including PDF, TXT, and DOCX files"""
-        assets_dir = os.path.join(os.path.dirname(__file__), 'assets')
-        if not os.path.exists(assets_dir):
+    def list_document_files() -> List[str]:
+        """List supported files in the assets folder"""
+        if not os.path.exists(ASSETS_DIR):
             return []
+        return [
+            os.path.join(ASSETS_DIR, filename)
+            for filename in sorted(os.listdir(ASSETS_DIR))
+            if os.path.splitext(filename)[1].lower() in ('.pdf', '.txt', '.docx')
+        ]
 
-        documents = []
-        for filename in os.listdir(assets_dir):
-            file_path = os.path.join(assets_dir, filename)
-            file_extension = os.path.splitext(filename)[1].lower()
-            
-            # Process based on file extension
-            if file_extension == '.pdf':
-                text = DocumentProcessor.extract_text_from_pdf(file_path)
-            elif file_extension == '.txt':
-                text = DocumentProcessor.extract_text_from_txt(file_path)
-            elif file_extension == '.docx':
-                text = DocumentProcessor.extract_text_from_docx(file_path)
+    @staticmethod
+    def process_files(file_paths: List[str], workers: int = INGEST_WORKERS) -> Dict[str, List[Dict]]:
+        """Parse and chunk files in a process pool, splitting large PDFs into page ranges.
+        
+        Returns {file path: [{"text", "metadata": {"source", "page"}}]} with chunks in page order.
+        """
+        import PyPDF2
+        tasks = []
+        for file_path in file_paths:
+            page_count = 0
+            if file_path.lower().endswith('.pdf'):
+                try:
+                    with open(file_path, 'rb') as file:
+                        page_count = len(PyPDF2.PdfReader(file).pages)
+                except Exception as e:
+                    print(f"Error reading PDF {file_path}: {e}")
+                    continue
+            if page_count > PDF_PAGES_PER_TASK:
+                tasks.extend((file_path, start, start + PDF_PAGES_PER_TASK)
+                             for start in range(0, page_count, PDF_PAGES_PER_TASK))
             else:
-                # Skip unsupported file types
-                continue
-                
-            if text:
-                # Split text into smaller chunks
-                chunks = [text[i:i+1000] for i in range(0, len(text), 1000)]
-                documents.extend(chunks)
-        return documents
-    
+                tasks.append((file_path, 0, None))
+        
+        started = time.perf_counter()
+        if workers > 1 and len(tasks) > 1:
+            # Refreshes run on a server thread; forking while another thread holds a lock can
+            # deadlock the child, so workers start from a fresh interpreter instead
+            with ProcessPoolExecutor(max_workers=min(workers, len(tasks)),
+                                     mp_context=multiprocessing.get_context("spawn")) as executor:
+                results = list(executor.map(_parse_task, tasks))
+        else:
+            results = [_parse_task(task) for task in tasks]
+        
+        chunks: Dict[str, List[Dict]] = {file_path: [] for file_path in file_paths}
+        pages = 0
+        for (file_path, _, _), (page_count, task_chunks) in zip(tasks, results):
+            chunks[file_path].extend(task_chunks)
+            pages += page_count
+        elapsed = time.perf_counter() - started
+        if tasks:
+            print(f"Parsed {pages} pages from {len(file_paths)} files into {sum(map(len, chunks.values()))} chunks "
+                  f"in {elapsed:.2f}s ({pages / elapsed if elapsed else 0:.1f} pages/sec)")
+        return chunks
+
     @staticmethod
     def extract_text_from_txt(txt_path: str) -> str:
         """Extract text from a TXT file"""
@@ -69,10 +124,16 @@ class DocumentProcessor:
     def extract_text_from_docx(docx_path: str) -> str:
         """Extract text from a DOCX file"""
         try:
+            import docx
             doc = docx.Document(docx_path)
             full_text = []
             for para in doc.paragraphs:
                 full_text.append(para.text)
+            # Keep each table row on one line so cells stay together when chunking
+            for table in doc.tables:
+                full_text.append("")
+                for row in table.rows:
+                    full_text.append(" | ".join(cell.text.strip() for cell in row.cells))
             return '\n'.join(full_text)
         except ImportError:
             print("python-docx module not installed. Please install it with: pip install python-docx")
@@ -82,138 +143,75 @@ class DocumentProcessor:
             return ""
 
     @staticmethod
-    def scrape_and_process_documents():
-        """Scrape the Angel One support website and process documents"""
-        base_url = "https://www.angelone.in/support"
+    def extract_text_blocks(soup: 'BeautifulSoup') -> List[str]:
+        """Extract the leaf-level text blocks of a parsed page.
         
+        A container such as an article contributes only its own loose text; the paragraphs
+        inside it are blocks of their own, so no text is extracted twice.
+        """
+        from bs4 import Comment
         documents = []
-        try:
-            # Scrape main page first
-            documents.extend(DocumentProcessor.scrape_page(base_url))
-            
-            # Find and scrape all linked pages recursively up to the specified levels deep
-            visited_urls = set([base_url])
-            urls_to_visit = set(DocumentProcessor.find_sub_pages(base_url))
-            
-            # Track the current level of recursion
-            current_level = 1
-            # Get max_levels from environment variable, default to 5 if not set
-            max_levels = int(os.getenv("MAX_SCRAPE_LEVELS", 5))
-            
-            print(f"Will scrape up to {max_levels} levels deep")
-            
-            while urls_to_visit and current_level <= max_levels:
-                print(f"Scraping level {current_level} with {len(urls_to_visit)} URLs to visit")
-                
-                # Get URLs for the current level
-                current_urls = urls_to_visit.copy()
-                urls_to_visit = set()
-                
-                for page_url in current_urls:
-                    if page_url not in visited_urls:
-                        # Add a small delay to avoid overwhelming the server
-                        time.sleep(0.5)
-                        
-                        # Scrape the page content
-                        page_documents = DocumentProcessor.scrape_page(page_url)
-                        documents.extend(page_documents)
-                        
-                        # Mark as visited
-                        visited_urls.add(page_url)
-                        
-                        # Find new sub-pages to visit in the next level
-                        new_urls = DocumentProcessor.find_sub_pages(page_url)
-                        for url in new_urls:
-                            if url not in visited_urls:
-                                urls_to_visit.add(url)
-                
-                # Move to the next level
-                current_level += 1
-            
-            print(f"Scraped a total of {len(visited_urls)} pages across {current_level-1} levels")
-            
-            # Process documents (PDF, TXT, DOCX)
-            local_documents = DocumentProcessor.process_documents()
-            
-            # Add local documents to documents_data in config.py
-            if local_documents:
-                # Join all document chunks into a single string
-                local_docs_text = " ".join(local_documents)
-                # Update the documents_data variable using the function
-                update_documents_data(local_docs_text)
-                print(f"Added {len(local_documents)} local document chunks to documents_data")
-            
-            # Add web-scraped documents to collection
-            if documents:
-                collection.add(
-                    documents=documents,
-                    ids=[f"doc_{i}" for i in range(len(documents))]
-                )
-                print(f"Added {len(documents)} web-scraped documents to collection")
-            
-        except Exception as e:
-            print(f"Error processing documents: {e}")
-            DocumentProcessor.add_fallback_content()
-
-    @staticmethod
-    def scrape_page(url: str) -> List[str]:
-        """Scrape a single page and extract text content"""
-        try:
-            response = requests.get(url)
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Extract text from relevant sections
-            content_sections = soup.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'article', 'section', 'div.content'])
-            
-            documents = []
-            for section in content_sections:
+        for section in soup.find_all(BLOCK_TAGS):
+            if section.find_parent(SKIPPED_TAGS):
+                continue
+            if section.find(BLOCK_TAGS):
+                loose = [child.get_text() if child.name else str(child) for child in section.children
+                         if not isinstance(child, Comment)
+                         and (not child.name or (child.name not in BLOCK_TAGS and not child.find(BLOCK_TAGS)))]
+                text = " ".join(part.strip() for part in loose if part.strip())
+            else:
                 text = section.get_text().strip()
-                if text and len(text) > 20:  # Filter out very short texts
-                    documents.append(text)
-            
-            return documents
-        except Exception as e:
-            print(f"Error scraping page {url}: {e}")
-            return []
+            if text and len(text) > 20:  # Filter out very short texts
+                documents.append(text)
+        return documents
 
     @staticmethod
-    def find_sub_pages(url: str) -> List[str]:
-        """Find all sub-pages linked from the given URL"""
+    def crawl_site(base_url: str = BASE_URL, previous_pages: Optional[Dict[str, Dict]] = None,
+                   on_progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, Dict]:
+        """Crawl the support site concurrently, fetching each page once.
+        
+        Returns {url: page} where page has "chunks" (None when the server says the page
+        is unchanged since previous_pages), "links", "etag" and "last_modified".
+        """
+        # Get max_levels from environment variable, default to 5 if not set
+        max_levels = int(os.getenv("MAX_SCRAPE_LEVELS", 5))
+        print(f"Will scrape up to {max_levels} levels deep")
+        
+        crawler = Crawler(DocumentProcessor.extract_text_blocks, timeout=REQUEST_TIMEOUT)
         try:
-            response = requests.get(url)
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Find all links
-            links = soup.find_all('a', href=True)
-            
-            # Extract and filter relevant links
-            sub_pages = set()
-            base_domain = url.split('/')[2]  # e.g., www.angelone.in
-            
-            for link in links:
-                href = link['href']
-                
-                # Handle relative URLs
-                if href.startswith('/'):
-                    href = f"https://{base_domain}{href}"
-                
-                # Only include links from the same domain and support-related pages
-                if base_domain in href and '/support' in href:
-                    sub_pages.add(href)
-            
-            return list(sub_pages)
-        except Exception as e:
-            print(f"Error finding sub-pages from {url}: {e}")
-            return []
+            return crawler.crawl(base_url, max_levels, previous_pages, on_progress)
+        finally:
+            crawler.close()
 
     @staticmethod
-    def add_fallback_content():
-        """Add fallback content to the collection"""
-        collection.add(
+    def add_fallback_content(target=None):
+        """Add fallback content to the collection (the web collection by default)"""
+        if target is None:
+            # Imported here so parsing workers, which import this module, don't build the collections
+            from config import collection
+            target = collection
+        FALLBACKS.inc()
+        target.add(
             documents=[
                 "Angel One offers online trading services.",
                 "Trading hours for NSE and BSE are 9:15 AM to 3:30 PM.",
                 "You can open a demat account through our website."
             ],
             ids=["doc_1", "doc_2", "doc_3"]
-        )
\ No newline at end of file
+        )
+
+
+def _parse_task(task: Tuple[str, int, Optional[int]]) -> Tuple[int, List[Dict]]:
+    """Parse and chunk one file or PDF page range; runs in a worker process"""
+    file_path, start, end = task
+    source = os.path.basename(file_path)
+    pages = 0
+    chunks = []
+    try:
+        for page, text in DocumentProcessor.iter_pages(file_path, start, end):
+            pages += 1
+            chunks.extend({"text": chunk, "metadata": {"source": source, "page": page}}
+                          for chunk in chunk_text(text))
+    except Exception as e:
+        print(f"Error reading {file_path}: {e}")
+    return pages, chunks
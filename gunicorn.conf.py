@@ -0,0 +1,21 @@
+# Multi-worker deployment: gunicorn -c gunicorn.conf.py app:app
+#
+# The knowledge base is built once, in the master before any worker is forked, and every
+# worker memory-maps the same snapshot files instead of crawling and holding its own copy.
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 8282)}"
+workers = int(os.getenv("WEB_CONCURRENCY", 4))
+worker_class = "uvicorn.workers.UvicornWorker"
+# Import app.py (and the embedding model) once in the master; workers share those pages copy-on-write
+preload_app = True
+# Loading the snapshot happens in the background after a worker starts, so the default timeout is enough
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+
+
+def on_starting(server):
+    """Load or build the snapshot before forking workers, so they only ever attach to it"""
+    from knowledge_base import KnowledgeBase
+    knowledge_base = KnowledgeBase()
+    if not knowledge_base.load():
+        knowledge_base.refresh()
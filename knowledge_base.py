@@ -0,0 +1,445 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional
+from config import collection, document_collection, SNAPSHOT_DIR
+from dedup import Deduplicator, block_hash, find_boilerplate, signature_from_hex, signature_to_hex
+from document_processor import DocumentProcessor
+from metrics import DEDUPLICATED_BLOCKS, REFRESH_SECONDS, REFRESHES
+from plan_facts import SBC_TITLE, PlanFact, PlanFactStore, extract_plan_facts
+
+try:
+    import fcntl
+except ImportError:
+    # Without flock (Windows) refreshes are only serialized within one process
+    fcntl = None
+
+# Bump when the snapshot layout changes; older snapshots are then rebuilt from scratch
+SNAPSHOT_VERSION = 9
+MANIFEST_FILE = "manifest.json"
+PLAN_FACTS_FILE = "plan_facts.json"
+# Held while a process crawls and writes a generation, so worker processes build it only once
+LOCK_FILE = "build.lock"
+VERSIONS_DIR = "versions"
+# Snapshot generations kept on disk; older ones are deleted after a new one is swapped in
+KEEP_GENERATIONS = 2
+FALLBACK_SOURCE = "fallback"
+# Seconds between background refreshes of the knowledge base; 0 disables them
+REFRESH_INTERVAL = float(os.getenv("REFRESH_INTERVAL", 0))
+# Seconds between checks for a newer snapshot written by another process; 0 disables them
+SNAPSHOT_POLL_INTERVAL = float(os.getenv("SNAPSHOT_POLL_INTERVAL", 30))
+
+
+def content_hash(data: bytes) -> str:
+    """Return the SHA-256 hex digest of the data"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class Snapshot(NamedTuple):
+    """One immutable generation of the corpus.
+    
+    Refreshes build a new Snapshot instead of changing this one, so a request that holds a
+    reference keeps reading consistent collections until it finishes.
+    """
+    generation: int
+    web: object
+    documents: object
+    plan_facts: PlanFactStore = PlanFactStore()
+
+    @property
+    def collections(self) -> Dict[str, object]:
+        return {"web": self.web, "documents": self.documents}
+
+
+class SnapshotBuilder:
+    """Applies source changes to copies of a snapshot's collections and source manifest"""
+
+    def __init__(self, snapshot: Snapshot, sources: Dict[str, Dict]):
+        self.collections = {name: target.copy() for name, target in snapshot.collections.items()}
+        self.sources = {key: dict(source) for key, source in sources.items()}
+        self.plan_facts: Dict[str, List[PlanFact]] = dict(snapshot.plan_facts.by_source)
+
+    def update_source(self, key: str, kind: str, chunks: List[Dict], digest: str, metadata: Dict) -> str:
+        """Replace the chunks ({"text", "metadata"}) of a source whose content hash changed"""
+        previous = self.sources.get(key)
+        if previous and previous["hash"] == digest:
+            previous.update(metadata, fetched_at=_now())
+            return "unchanged"
+        
+        if previous:
+            self.delete_source(key)
+        prefix = content_hash(key.encode('utf-8'))[:12]
+        chunk_ids = [f"{prefix}_{i}" for i in range(len(chunks))]
+        if chunks:
+            self.collections[kind].add(
+                documents=[chunk["text"] for chunk in chunks],
+                ids=chunk_ids,
+                metadatas=[chunk["metadata"] for chunk in chunks]
+            )
+        self.sources[key] = dict(metadata, kind=kind, hash=digest, fetched_at=_now(), chunk_ids=chunk_ids)
+        return "updated" if previous else "added"
+
+    def delete_source(self, key: str):
+        source = self.sources.pop(key)
+        self.collections[source["kind"]].delete(source["chunk_ids"])
+        self.plan_facts.pop(key, None)
+
+    def build(self, generation: int) -> Snapshot:
+        return Snapshot(generation, self.collections["web"], self.collections["documents"], PlanFactStore(self.plan_facts))
+
+
+class KnowledgeBase:
+    """Versioned on-disk snapshot of the ingested corpus that can be refreshed incrementally.
+    
+    The manifest records, for every source URL or file, its content hash, HTTP validators,
+    fetch time and the ids of its chunks, so a refresh only re-chunks and re-indexes the
+    sources whose content actually changed. Each generation is written to its own directory
+    and the manifest is switched to it last, so the files of a served generation never change.
+    
+    Collections are memory-mapped from those files, so several worker processes serving the
+    same directory share one copy of the corpus. A file lock ensures only one process crawls
+    and writes at a time; the others load what it wrote.
+    """
+
+    def __init__(self, directory: str = SNAPSHOT_DIR, web_collection=collection, doc_collection=document_collection):
+        self.directory = directory
+        # The snapshot being served; refresh() replaces it as a whole
+        self.snapshot = Snapshot(0, web_collection, doc_collection)
+        # source key (URL or file name) -> metadata
+        self.sources: Dict[str, Dict] = {}
+        # Serializes refreshes; readers never take it
+        self.refresh_lock = threading.Lock()
+        # Outcome of the most recent refresh
+        self.last_refresh: Dict = {}
+        # What loading or refreshing is doing right now, for readiness checks
+        self.progress: Dict = {"stage": "idle"}
+        # Blocks and characters removed as boilerplate or duplicates by the last crawl
+        self.last_dedup: Dict = {}
+        # Modification time of the manifest this process last loaded or wrote
+        self.manifest_mtime = 0.0
+
+    @property
+    def generation(self) -> int:
+        """Incremented whenever a refresh changes the chunk set"""
+        return self.snapshot.generation
+
+    @property
+    def refreshing(self) -> bool:
+        return self.refresh_lock.locked()
+
+    def generation_path(self, generation: int) -> str:
+        return os.path.join(self.directory, VERSIONS_DIR, str(generation))
+
+    def current_manifest_mtime(self) -> float:
+        try:
+            return os.stat(os.path.join(self.directory, MANIFEST_FILE)).st_mtime
+        except FileNotFoundError:
+            return 0.0
+
+    @contextmanager
+    def build_lock(self):
+        """Hold the snapshot directory's build lock, waiting for any other process that holds it"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, LOCK_FILE), 'a') as file:
+            if fcntl:
+                fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(file, fcntl.LOCK_UN)
+
+    def reload_if_changed(self) -> bool:
+        """Load the snapshot if another process has written a new manifest since ours; returns True if it did"""
+        if self.refreshing or self.current_manifest_mtime() <= self.manifest_mtime:
+            return False
+        generation = self.generation
+        if not self.load():
+            return False
+        if self.generation != generation:
+            print(f"Switched to knowledge base generation {self.generation} written by another process")
+        return True
+
+    def load(self) -> bool:
+        """Load the snapshot from disk; returns False when there is no usable snapshot"""
+        manifest_path = os.path.join(self.directory, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return False
+        
+        started = time.perf_counter()
+        self.progress = {"stage": "loading_snapshot"}
+        mtime = self.current_manifest_mtime()
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as file:
+                manifest = json.load(file)
+            if manifest.get("version") != SNAPSHOT_VERSION:
+                print(f"Snapshot version {manifest.get('version')} is not supported; rebuilding")
+                return False
+            collections = {name: target.empty() for name, target in self.snapshot.collections.items()}
+            for name, target in collections.items():
+                if not target.load(os.path.join(self.generation_path(manifest["generation"]), name)):
+                    return False
+            plan_facts = PlanFactStore.load(os.path.join(self.generation_path(manifest["generation"]), PLAN_FACTS_FILE))
+        except Exception as e:
+            print(f"Error loading snapshot from {self.directory}: {e}")
+            return False
+        finally:
+            self.progress = {"stage": "idle"}
+        
+        self.sources = manifest["sources"]
+        self.snapshot = Snapshot(manifest["generation"], collections["web"], collections["documents"], plan_facts)
+        self.manifest_mtime = mtime
+        print(f"Loaded snapshot generation {self.generation} with {len(self.sources)} sources "
+              f"in {time.perf_counter() - started:.3f}s")
+        return True
+
+    def save(self, snapshot: Optional[Snapshot] = None, sources: Optional[Dict[str, Dict]] = None):
+        """Write the snapshot's collections into its generation directory, then the manifest that points at it"""
+        snapshot = snapshot or self.snapshot
+        for name, target in snapshot.collections.items():
+            target.save(os.path.join(self.generation_path(snapshot.generation), name))
+        snapshot.plan_facts.save(os.path.join(self.generation_path(snapshot.generation), PLAN_FACTS_FILE))
+        self.write_manifest(snapshot.generation, self.sources if sources is None else sources)
+
+    def write_manifest(self, generation: int, sources: Dict[str, Dict]):
+        """Atomically replace the manifest, which marks the generation as complete and current"""
+        os.makedirs(self.directory, exist_ok=True)
+        manifest_path = os.path.join(self.directory, MANIFEST_FILE)
+        with open(manifest_path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump({
+                "version": SNAPSHOT_VERSION,
+                "generation": generation,
+                "saved_at": datetime.now(timezone.utc).isoformat(),
+                "sources": sources
+            }, file)
+        os.replace(manifest_path + '.tmp', manifest_path)
+        self.manifest_mtime = self.current_manifest_mtime()
+
+    def refresh(self) -> Optional[Dict[str, int]]:
+        """Re-fetch every source and rebuild the ones whose content changed into a new snapshot.
+        
+        The rebuild works on copies of the served collections, and the finished snapshot is
+        swapped in with a single assignment, so answers in flight keep reading the previous
+        one. Returns None when another refresh is already running in this process, or when
+        another process finished one while this one waited for the build lock; its snapshot is
+        loaded instead of crawling again.
+        """
+        if not self.refresh_lock.acquire(blocking=False):
+            print("A knowledge-base refresh is already running")
+            return None
+        
+        started = time.perf_counter()
+        started_at = _now()
+        waited_from = time.time()
+        try:
+            with self.build_lock():
+                written_meanwhile = self.current_manifest_mtime() >= waited_from
+                # Build on top of the newest generation on disk, which another process may have written
+                if self.current_manifest_mtime() > self.manifest_mtime:
+                    self.load()
+                if written_meanwhile:
+                    print(f"Another process refreshed the knowledge base; using its generation {self.generation}")
+                    return None
+                stats = self._rebuild()
+        except Exception as e:
+            REFRESHES.inc(result="failed")
+            self.last_refresh = {"started_at": started_at, "seconds": time.perf_counter() - started,
+                                 "stats": None, "error": str(e)}
+            raise
+        finally:
+            REFRESH_SECONDS.observe(time.perf_counter() - started)
+            self.progress = {"stage": "idle"}
+            self.refresh_lock.release()
+        
+        self.last_refresh = {"started_at": started_at, "seconds": time.perf_counter() - started,
+                             "stats": stats, "error": None}
+        return stats
+
+    def _rebuild(self) -> Dict[str, int]:
+        stats = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0}
+        current = self.snapshot
+        builder = SnapshotBuilder(current, self.sources)
+        seen = set()
+        
+        self.progress = {"stage": "crawling"}
+        previous_pages = {key: source for key, source in builder.sources.items() if source["kind"] == "web"}
+        try:
+            pages = DocumentProcessor.crawl_site(
+                previous_pages=previous_pages,
+                on_progress=lambda crawled, level: self.progress.update(pages_crawled=crawled, level=level))
+        except Exception as e:
+            print(f"Error crawling support site: {e}")
+            pages = {}
+        
+        seen.update(pages)
+        self.progress = {"stage": "deduplicating", "pages_crawled": len(pages)}
+        self.ingest_pages(builder, pages, stats)
+        
+        changed_files = {}
+        for file_path in DocumentProcessor.list_document_files():
+            key = os.path.basename(file_path)
+            seen.add(key)
+            with open(file_path, 'rb') as file:
+                digest = content_hash(file.read())
+            if key in builder.sources and builder.sources[key]["hash"] == digest:
+                builder.sources[key]["fetched_at"] = _now()
+                stats["unchanged"] += 1
+            else:
+                changed_files[file_path] = digest
+        
+        self.progress = {"stage": "parsing", "pages_crawled": len(pages), "files_to_parse": len(changed_files)}
+        # Parse all changed files together so they share one process pool
+        for file_path, chunks in DocumentProcessor.process_files(list(changed_files)).items():
+            key = os.path.basename(file_path)
+            stats[builder.update_source(key, "documents", chunks, changed_files[file_path], {})] += 1
+            facts = self.extract_plan_facts(file_path)
+            if facts:
+                builder.plan_facts[key] = facts
+        
+        # Drop sources that disappeared; keep web sources when the crawl failed entirely
+        for key in list(builder.sources):
+            if key in seen or (not pages and builder.sources[key]["kind"] == "web"):
+                continue
+            builder.delete_source(key)
+            stats["removed"] += 1
+        
+        if builder.collections["web"].count() == 0:
+            print("No webpage content was ingested; adding fallback content")
+            DocumentProcessor.add_fallback_content(builder.collections["web"])
+            builder.sources[FALLBACK_SOURCE] = {"kind": "web", "hash": "", "fetched_at": _now(),
+                                                "chunk_ids": ["doc_1", "doc_2", "doc_3"]}
+            stats["added"] += 1
+        
+        if stats["added"] or stats["updated"] or stats["removed"] or not os.path.isdir(self.generation_path(current.generation)):
+            snapshot = builder.build(current.generation + 1)
+            self.progress = {"stage": "saving", "generation": snapshot.generation}
+            self.save(snapshot, builder.sources)
+            # The swap: requests that already hold the previous snapshot finish on it
+            self.snapshot, self.sources = snapshot, builder.sources
+            self.prune_generations()
+            REFRESHES.inc(result="swapped")
+            print(f"Swapped in knowledge base generation {self.generation}: {stats}")
+        else:
+            self.sources = builder.sources
+            self.write_manifest(current.generation, self.sources)
+            REFRESHES.inc(result="unchanged")
+            print(f"Knowledge base generation {self.generation} is up to date: {stats}")
+        return stats
+
+    def ingest_pages(self, builder: SnapshotBuilder, pages: Dict[str, Dict], stats: Dict[str, int]):
+        """Store crawled pages without boilerplate, repeated blocks or near-duplicate pages.
+        
+        Unchanged (304) pages keep their stored blocks and claim them first; changed pages
+        are then filtered in URL order, so the result doesn't depend on crawl timing.
+        """
+        page_hashes = {url: [block_hash(block) for block in page["chunks"]] if page["chunks"] is not None
+                       else builder.sources[url].get("block_hashes", [])
+                       for url, page in pages.items()}
+        boilerplate = find_boilerplate(page_hashes)
+        deduplicator = Deduplicator(boilerplate)
+        
+        unchanged = [url for url, page in pages.items() if page["chunks"] is None]
+        for url in sorted(unchanged):
+            source = builder.sources[url]
+            source.update(etag=pages[url]["etag"], last_modified=pages[url]["last_modified"],
+                          links=pages[url]["links"], fetched_at=_now())
+            stats["unchanged"] += 1
+            # Blocks that became boilerplate since they were stored are dropped from the copy
+            kept = [(chunk_id, digest) for chunk_id, digest in zip(source["chunk_ids"], source.get("kept_hashes", []))
+                    if digest not in boilerplate]
+            if len(kept) < len(source["chunk_ids"]):
+                kept_ids = {chunk_id for chunk_id, _ in kept}
+                builder.collections["web"].delete([chunk_id for chunk_id in source["chunk_ids"] if chunk_id not in kept_ids])
+                source["chunk_ids"] = [chunk_id for chunk_id, _ in kept]
+                source["kept_hashes"] = [digest for _, digest in kept]
+                stats["unchanged"] -= 1
+                stats["updated"] += 1
+            signature = signature_from_hex(source["minhash"]) if source.get("minhash") else None
+            deduplicator.register(url, source.get("kept_hashes", []), signature)
+        
+        for url in sorted(set(pages) - set(unchanged)):
+            page = pages[url]
+            result = deduplicator.filter_page(url, page["chunks"], page_hashes[url])
+            metadata = {"etag": page["etag"], "last_modified": page["last_modified"], "links": page["links"],
+                        "block_hashes": result["block_hashes"], "kept_hashes": result["kept_hashes"],
+                        "minhash": signature_to_hex(result["signature"]) if result["signature"] is not None else None,
+                        "duplicate_of": result["duplicate_of"]}
+            # Hash what is stored, so a page whose blocks are now owned elsewhere is rewritten
+            digest = content_hash("\0".join(result["blocks"] + [result["duplicate_of"] or ""]).encode('utf-8'))
+            chunks = [{"text": text, "metadata": {"source": url}} for text in result["blocks"]]
+            stats[builder.update_source(url, "web", chunks, digest, metadata)] += 1
+        
+        # An unchanged page may hold a block (or whole text) whose keeper changed or disappeared;
+        # dropping its validators makes the next crawl fetch and filter it again
+        kept = {digest for url in pages for digest in builder.sources[url].get("kept_hashes", [])}
+        for url in unchanged:
+            source = builder.sources[url]
+            orphaned = source.get("duplicate_of") and source["duplicate_of"] not in pages
+            if orphaned or any(digest not in kept and digest not in boilerplate for digest in page_hashes[url]):
+                source.update(etag=None, last_modified=None)
+        
+        self.last_dedup = deduplicator.report()
+        DEDUPLICATED_BLOCKS.inc(deduplicator.stats["boilerplate"], reason="boilerplate")
+        DEDUPLICATED_BLOCKS.inc(deduplicator.stats["duplicate"], reason="duplicate")
+        if deduplicator.stats["blocks"]:
+            print(f"Deduplicated {len(pages) - len(unchanged)} crawled pages: "
+                  f"{deduplicator.stats['blocks']} -> {deduplicator.stats['kept_blocks']} blocks, "
+                  f"{deduplicator.stats['chars']} -> {deduplicator.stats['kept_chars']} characters "
+                  f"({self.last_dedup['reduction']:.0%} smaller)")
+
+    @staticmethod
+    def extract_plan_facts(file_path: str) -> List[PlanFact]:
+        """Benefit rows of a plan summary PDF; other files, and PDFs that aren't summaries, have none"""
+        if not file_path.lower().endswith('.pdf'):
+            return []
+        try:
+            pages = DocumentProcessor.iter_pdf_pages(file_path)
+            first = next(pages, None)
+            if first is None or SBC_TITLE not in " ".join(first[1].split()):
+                return []
+            facts = extract_plan_facts(file_path, [first, *pages])
+        except Exception as e:
+            print(f"Error extracting plan facts from {file_path}: {e}")
+            return []
+        print(f"Extracted {len(facts)} benefit facts for {facts[0].plan if facts else file_path}")
+        return facts
+
+    def prune_generations(self):
+        """Delete all but the newest generation directories.
+        
+        Processes still memory-mapping a deleted generation keep reading it until they reload.
+        """
+        versions = os.path.join(self.directory, VERSIONS_DIR)
+        generations = sorted((int(name) for name in os.listdir(versions) if name.isdigit()), reverse=True)
+        for generation in generations[KEEP_GENERATIONS:]:
+            shutil.rmtree(self.generation_path(generation), ignore_errors=True)
+
+    def status(self) -> Dict:
+        """Served generation, chunk counts and the outcome of the last refresh"""
+        snapshot = self.snapshot
+        return {
+            "generation": snapshot.generation,
+            "sources": len(self.sources),
+            "chunks": {name: target.count() for name, target in snapshot.collections.items()},
+            "plan_facts": len(snapshot.plan_facts),
+            "refreshing": self.refreshing,
+            "progress": self.progress,
+            "last_refresh": self.last_refresh or None,
+            "deduplication": self.last_dedup or None
+        }
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+if __name__ == "__main__":
+    # Build or incrementally refresh the snapshot without starting the server
+    knowledge_base = KnowledgeBase()
+    knowledge_base.load()
+    knowledge_base.refresh()
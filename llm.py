@@ -0,0 +1,138 @@
+import asyncio
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+from typing import AsyncIterator, Callable, Optional
+
+# Maximum LLM calls in flight per process, per-call timeout in seconds, and retries on transient errors
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 30))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", 0.5))
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether an LLM error is worth retrying (timeouts, throttling, 5xx)"""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    try:
+        from google.api_core import exceptions
+    except ImportError:
+        return False
+    return isinstance(error, (exceptions.TooManyRequests, exceptions.ResourceExhausted,
+                              exceptions.ServiceUnavailable, exceptions.InternalServerError,
+                              exceptions.DeadlineExceeded))
+
+
+def chunk_text(chunk) -> str:
+    """Text of a streamed chunk; chunks without text parts (e.g. safety-only) yield an empty string"""
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+
+class AsyncLLMClient:
+    """Runs model generation off the event loop with bounded concurrency, timeouts and retries"""
+
+    def __init__(self, model=None, max_concurrency: int = LLM_MAX_CONCURRENCY, timeout: float = LLM_TIMEOUT,
+                 max_retries: int = LLM_MAX_RETRIES, retry_base_delay: float = LLM_RETRY_BASE_DELAY,
+                 loader: Optional[Callable] = None):
+        # The model, or None until loader creates it on first use
+        self._model = model
+        self.loader = loader
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        # Only used for models without an async client; sized so it never queues behind the semaphore
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = self.loader()
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self._model = model
+
+    async def generate(self, prompt: str) -> str:
+        """Generate a completion for the prompt and return its text"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self.semaphore:
+                    response = await asyncio.wait_for(self._call(prompt), self.timeout)
+                return response.text.strip()
+            except Exception as e:
+                if attempt == self.max_retries or not is_transient(e):
+                    raise
+                # Full jitter: spread retries out so throttled callers don't retry in lockstep
+                delay = random.uniform(0, self.retry_base_delay * 2 ** attempt)
+                print(f"Transient LLM error ({e!r}); retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        """Yield completion text as the model produces it.
+        
+        Closing the generator (for example when the client disconnects) stops the
+        upstream generation instead of letting it run to completion.
+        """
+        async with self.semaphore:
+            if hasattr(self.model, 'generate_content_async'):
+                response = await asyncio.wait_for(self.model.generate_content_async(prompt, stream=True), self.timeout)
+                chunks = response.__aiter__()
+                try:
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), self.timeout)
+                        except StopAsyncIteration:
+                            break
+                        text = chunk_text(chunk)
+                        if text:
+                            yield text
+                finally:
+                    if hasattr(chunks, 'aclose'):
+                        await chunks.aclose()
+            else:
+                async with aclosing(self._stream_in_thread(prompt)) as stream:
+                    async for text in stream:
+                        yield text
+
+    async def _stream_in_thread(self, prompt: str) -> AsyncIterator[str]:
+        """Consume a synchronous streaming response on the executor and hand chunks to the event loop"""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        cancelled = threading.Event()
+
+        def produce():
+            try:
+                for chunk in self.model.generate_content(prompt, stream=True):
+                    if cancelled.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, ("text", chunk_text(chunk)))
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, ("error", e))
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, ("done", None))
+
+        loop.run_in_executor(self.executor, produce)
+        try:
+            while True:
+                kind, value = await asyncio.wait_for(queue.get(), self.timeout)
+                if kind == "done":
+                    break
+                if kind == "error":
+                    raise value
+                if value:
+                    yield value
+        finally:
+            cancelled.set()
+
+    def _call(self, prompt: str):
+        if hasattr(self.model, 'generate_content_async'):
+            return self.model.generate_content_async(prompt)
+        return asyncio.get_running_loop().run_in_executor(self.executor, self.model.generate_content, prompt)
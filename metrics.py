@@ -0,0 +1,221 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional, Tuple
+
+# Add a Server-Timing header with the per-stage breakdown to API responses
+TIMING_HEADER = os.getenv("TIMING_HEADER", "false").lower() == "true"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (256, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072, 262144)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    """Base class for a named metric rendered in the Prometheus text format"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+    def samples(self):
+        return []
+
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self.values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self.lock:
+            return self.values.get(_label_key(labels), 0)
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(Metric):
+    """Value that can go up and down, either set directly or read from a callback at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self.values: Dict[LabelKey, float] = {}
+        self.functions: Dict[LabelKey, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[_label_key(labels)] = value
+
+    def set_function(self, function: Callable[[], float], **labels):
+        with self.lock:
+            self.functions[_label_key(labels)] = function
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+            functions = dict(self.functions)
+        for key, function in functions.items():
+            try:
+                values[key] = function()
+            except Exception as e:
+                print(f"Error reading gauge {self.name}: {e}")
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    """Distribution of observations in cumulative buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets)
+        # label key -> (per-bucket counts with a final +Inf bucket, sum, count)
+        self.values: Dict[LabelKey, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self.lock:
+            items = sorted((key, [list(state[0]), state[1], state[2]]) for key, state in self.values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float('inf') else _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics exposed together"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric):
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+# Answer path
+REQUEST_SECONDS = Histogram("rag_request_seconds", "Total API request latency", LATENCY_BUCKETS)
+CONTEXT_SECONDS = Histogram("rag_context_assembly_seconds", "Time spent retrieving context and building the prompt")
+LLM_SECONDS = Histogram("rag_llm_call_seconds", "Latency of LLM generation calls")
+PROMPT_CHARS = Histogram("rag_prompt_chars", "Prompt size in characters", SIZE_BUCKETS)
+PROMPT_TOKENS = Histogram("rag_prompt_tokens", "Estimated prompt size in tokens", tuple(b // 4 for b in SIZE_BUCKETS))
+PROMPT_TRUNCATIONS = Counter("rag_prompt_truncations_total", "Prompt parts cut or dropped to fit the token budget, by part (question, history, documents, webpages)")
+ERRORS = Counter("rag_errors_total", "Errors while answering questions, by stage")
+PLAN_FACT_ROUTES = Counter("rag_plan_fact_routes_total", "Questions routed to the plan fact index, by route (direct, rows, rows_and_documents)")
+LLM_SHED = Counter("rag_llm_shed_total", "LLM calls refused without calling the model, by reason (queue_full, deadline, circuit_open)")
+LLM_COALESCED = Counter("rag_llm_coalesced_total", "Requests that shared an identical LLM call already in flight")
+
+# Ingestion
+FALLBACKS = Counter("rag_fallback_content_total", "Times fallback content was added because nothing was ingested")
+CRAWL_PAGES = Counter("crawl_pages_total", "Crawled pages by result (fetched, not_modified, failed)")
+CRAWL_BYTES = Counter("crawl_bytes_downloaded_total", "Bytes downloaded by the crawler")
+REFRESH_SECONDS = Histogram("rag_refresh_seconds", "Duration of knowledge-base refreshes", LATENCY_BUCKETS + (120, 300, 600))
+REFRESHES = Counter("rag_refreshes_total", "Knowledge-base refreshes by result (swapped, unchanged, failed)")
+DEDUPLICATED_BLOCKS = Counter("crawl_deduplicated_blocks_total", "Crawled text blocks dropped, by reason (boilerplate, duplicate)")
+
+# State, read at scrape time
+CORPUS_CHUNKS = Gauge("rag_corpus_chunks", "Chunks in each collection")
+LIVE_CONVERSATIONS = Gauge("rag_live_conversations", "Conversations currently stored")
+SNAPSHOT_GENERATION = Gauge("rag_snapshot_generation", "Generation of the knowledge-base snapshot currently served")
+LLM_QUEUE_DEPTH = Gauge("rag_llm_queue_depth", "LLM calls waiting for a concurrency slot")
+LLM_RUNNING = Gauge("rag_llm_running", "LLM calls holding a concurrency slot")
+LLM_CIRCUIT_OPEN = Gauge("rag_llm_circuit_open", "1 while the LLM circuit breaker refuses calls, 0 otherwise")
+
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def start_request_timing():
+    """Start collecting per-stage timings for the current request; returns a token for reset"""
+    return _request_timings.set({})
+
+
+def request_timings() -> Dict[str, float]:
+    """Per-stage timings of the current request; stages recorded later, e.g. while streaming, are added to it"""
+    timings = _request_timings.get()
+    return timings if timings is not None else {}
+
+
+def reset_request_timing(token):
+    _request_timings.reset(token)
+
+
+@contextmanager
+def timed(histogram: Histogram, stage: str):
+    """Observe the duration of the block and add it to the current request's breakdown"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        histogram.observe(elapsed)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    """Format timings as a Server-Timing header value, in milliseconds"""
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
@@ -0,0 +1,336 @@
+import json
+import os
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# Answer plan lookups that name a plan and a benefit straight from the fact index, without the model
+PLAN_FACT_ANSWERS = os.getenv("PLAN_FACT_ANSWERS", "true").lower() == "true"
+# Lookups matching more rows than this go to the model with just those rows
+DIRECT_ANSWER_MAX_FACTS = 6
+# Benefit phrases with everyday or trading meanings ("take delivery", "network charges"); a question
+# asking about a benefit only through these goes to the model even when it names a plan
+AMBIGUOUS_PHRASES = {"delivery", "network", "er", "emergency", "scan", "scans", "ct", "lab", "labs", "doctor",
+                     "diagnostic", "generic", "generics", "brand drugs", "specialist", "specialists", "hospital",
+                     "vision", "glasses", "dental", "referral", "referrals", "surgeon"}
+
+# Marks a PDF as a Summary of Benefits and Coverage
+SBC_TITLE = "Summary of Benefits and Coverage"
+
+# SBC rows in document order: (benefit, label as printed, phrases that ask about it).
+# The layout is standardized, so the same labels appear in every plan's summary.
+SBC_ROWS: List[Tuple[str, str, List[str]]] = [
+    ("Overall deductible", "What is the overall deductible?", ["deductible", "deductibles"]),
+    ("Services covered before the deductible", "Are there services covered before you meet your deductible?",
+     ["before the deductible", "before deductible", "before i meet", "before you meet"]),
+    ("Deductibles for specific services", "Are there other deductibles for specific services?",
+     ["other deductibles", "deductibles for specific services"]),
+    ("Out-of-pocket limit", "What is the out-of-pocket limit for this plan?",
+     ["out of pocket", "oop", "out of pocket limit", "out of pocket maximum", "maximum out of pocket"]),
+    ("Not included in the out-of-pocket limit", "What is not included in the out-of-pocket limit?",
+     ["not included in the out of pocket", "count toward the out of pocket", "count towards the out of pocket"]),
+    ("Network providers", "Will you pay less if you use a network provider?",
+     ["network", "in network", "out of network", "network provider", "network providers"]),
+    ("Specialist referral", "Do you need a referral to see a specialist?", ["referral", "referrals"]),
+    ("Primary care visit", "Primary care visit to treat an injury or illness",
+     ["primary care", "pcp", "doctor visit", "doctor's visit", "doctor"]),
+    ("Specialist visit", "Specialist visit", ["specialist", "specialists", "specialist visit"]),
+    ("Chiropractic care", "Chiropractic Care", ["chiropractic", "chiropractor"]),
+    ("Preventive care/screening/immunization", "Preventive care/screening/immunization",
+     ["preventive", "preventive care", "screening", "immunization", "immunizations", "vaccine", "vaccines"]),
+    ("Diagnostic test (x-ray, blood work)", "Diagnostic test",
+     ["diagnostic", "diagnostic test", "blood work", "blood test", "lab", "labs", "lab test", "lab work"]),
+    ("Imaging (CT/PET scans, MRIs)", "Imaging",
+     ["imaging", "x ray", "xray", "mri", "mris", "ct", "ct scan", "pet scan", "scan", "scans"]),
+    ("Generic drugs", "Generic drugs", ["generic", "generic drugs", "generics"]),
+    ("Preferred brand drugs", "Preferred brand drugs", ["preferred brand", "brand name", "brand drugs"]),
+    ("Non-preferred brand drugs", "Non-preferred brand drugs", ["non preferred", "non preferred brand"]),
+    ("Specialty drugs", "Specialty drugs", ["specialty drug", "specialty drugs", "specialty medication"]),
+    ("Outpatient surgery facility fee", "Facility fee (e.g., ambulatory surgery center)",
+     ["outpatient surgery", "ambulatory surgery", "surgery center"]),
+    ("Outpatient surgery physician/surgeon fees", "Physician/surgeon fees", ["outpatient surgery", "surgeon"]),
+    ("Emergency room care", "Emergency room care", ["emergency room", "er", "emergency"]),
+    ("Emergency medical transportation", "Emergency medical transportation",
+     ["ambulance", "emergency transportation", "emergency medical transportation"]),
+    ("Urgent care", "Urgent care", ["urgent care"]),
+    ("Hospital stay facility fee", "Facility fee (e.g., hospital room)",
+     ["hospital stay", "hospital room", "hospitalization", "hospital"]),
+    ("Hospital stay physician/surgeon fees", "Physician/surgeon fees", ["hospital stay", "surgeon"]),
+    ("Mental health outpatient services", "Outpatient services",
+     ["mental health", "behavioral health", "substance abuse"]),
+    ("Mental health inpatient services", "Inpatient services", ["mental health", "behavioral health", "substance abuse"]),
+    ("Pregnancy office visits", "Office visits", ["pregnancy", "pregnant", "prenatal", "maternity"]),
+    ("Childbirth/delivery professional services", "Childbirth/delivery professional services",
+     ["childbirth", "delivery", "pregnancy", "pregnant", "maternity"]),
+    ("Childbirth/delivery facility services", "Childbirth/delivery facility services",
+     ["childbirth", "delivery", "pregnancy", "pregnant", "maternity"]),
+    ("Home health care", "Home health care", ["home health", "home health care"]),
+    ("Rehabilitation services", "Rehabilitation services",
+     ["rehabilitation", "rehab", "physical therapy", "occupational therapy", "speech therapy"]),
+    ("Habilitation services", "Habilitation services", ["habilitation"]),
+    ("Skilled nursing care", "Skilled nursing care", ["skilled nursing", "nursing facility"]),
+    ("Durable medical equipment", "Durable medical equipment", ["durable medical equipment", "dme", "wheelchair"]),
+    ("Hospice services", "Hospice services", ["hospice"]),
+    ("Children's eye exam", "Children's eye exam", ["eye exam", "vision", "eye care"]),
+    ("Children's glasses", "Children's glasses", ["glasses"]),
+    ("Children's dental check-up", "Children's dental check-up", ["dental", "dental check up", "dentist"]),
+]
+# Rows that only some plans list; they are accepted only before the next row every plan has
+OPTIONAL_ROWS = {"Chiropractic care"}
+
+# Where the benefit tables end
+TABLE_END = re.compile(r"Excluded Services & Other Covered Services")
+# Repeated page headers, removed so rows that continue on the next page stay whole
+PAGE_HEADERS = [
+    re.compile(r"Common Medical Event Services You May Need .{0,200}?Other Important Information"),
+    re.compile(r"\b\d+ of \d+ \[\* For more information .{0,200}?\.com\b"),
+]
+# Headings of the "Common Medical Event" column, which end the row printed before them
+EVENT_HEADING = re.compile(r"\bIf (?:you|your child) (?:visit|have a test|need drugs|have outpatient|need immediate|"
+                           r"have a hospital|need mental|are pregnant|need help|needs)\b")
+# Where the cost in a row ends and the explanation or limitations begin
+NOTES_START = re.compile(r"\b(?:Subject to|Failure to|Limited to|You may have to|Copays listed|Copays apply|None\b|"
+                         r"Please refer|\d+ visit limitations|Generally,|This plan covers|You don't have to|"
+                         r"The out-of-pocket limit is|Even though you pay|You can see the specialist)")
+# Facility and professional charges, which belong to the cost even when printed after the notes
+COST_PARTS = re.compile(r"(?:Facility|Professional Fees): \d+% (?:after deductible|of plan allowable, deductible does not apply)")
+# Questions that ask for reasoning rather than a value go to the model even when rows match
+REASONING = re.compile(r"\b(?:why|explain|compare|comparison|better|best|should|difference|differ|recommend|"
+                       r"versus|vs|cheaper|worth|which)\b|\bhow (?:do|does|can|would|should)\b")
+
+
+class PlanFact(NamedTuple):
+    """One row of a plan's benefits summary"""
+    plan: str
+    benefit: str
+    in_network: str
+    out_of_network: Optional[str]
+    notes: str
+    source: str
+    page: int
+
+    def as_text(self) -> str:
+        """One line for the model's context"""
+        parts = [self.plan, self.benefit, f"In-network: {self.in_network}"]
+        if self.out_of_network:
+            parts.append(f"Out-of-network: {self.out_of_network}")
+        if self.notes:
+            parts.append(f"Notes: {self.notes}")
+        return " | ".join(parts) + f" (source: {self.source}, page {self.page})"
+
+
+def normalize_query(text: str) -> str:
+    """Lowercase words separated by single spaces, with thousands separators and dollar signs dropped"""
+    text = text.lower().replace("’", "'")
+    text = re.sub(r"(?<=\d),(?=\d{3})", "", text)
+    return " ".join(re.sub(r"[^a-z0-9']+", " ", text).split())
+
+
+def _flexible(label: str) -> re.Pattern:
+    """Match a label even where PDF extraction split or joined its words"""
+    return re.compile(r"\s*".join(re.escape(char) for char in label.replace(" ", "")))
+
+
+LABEL_PATTERNS = [_flexible(label) for _, label, _ in SBC_ROWS]
+
+# phrase -> benefits it asks about, longest phrases first so "non preferred brand" wins over "preferred brand"
+BENEFIT_PHRASES: List[Tuple[str, List[str]]] = sorted(
+    {phrase: [benefit for benefit, _, phrases in SBC_ROWS if phrase in phrases]
+     for _, _, phrases in SBC_ROWS for phrase in phrases}.items(),
+    key=lambda item: -len(item[0]))
+
+
+def _clean(text: str) -> str:
+    """Undo the spacing artifacts of PDF text extraction"""
+    text = re.sub(r"\$ (?=\d)", "$", text)
+    text = re.sub(r"(?<=\d) ,(?=\d)", ",", text)
+    text = re.sub(r" /(?=\w)", "/", text)
+    text = re.sub(r"(?<=\w) -(?=\w)|(?<=\w)- (?=\w)", "-", text)
+    text = re.sub(r" (?=[.,;:?)])", "", text)
+    return text.strip(" ,;")
+
+
+def plan_name(file_path: str) -> str:
+    """Plan name from a summary's file name, e.g. "America's Choice 5000 Bronze" """
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    match = re.match(r"(.*?)_SOB", name)
+    return (match.group(1) if match else name).replace("_", " ").strip()
+
+
+def extract_plan_facts(file_path: str, pages: Iterable[Tuple[int, str]]) -> List[PlanFact]:
+    """Parse the benefit rows of a Summary of Benefits and Coverage PDF from its (page, text) pairs.
+
+    Returns no facts for documents that aren't benefit summaries.
+    """
+    parts, page_starts, length = [], [], 0
+    for page, page_text in pages:
+        page_text = " ".join(page_text.replace("’", "'").split())
+        page_starts.append((length, page))
+        parts.append(page_text)
+        length += len(page_text) + 1
+    text = " ".join(parts)
+    if SBC_TITLE not in text:
+        return []
+    end = TABLE_END.search(text)
+    text = text[:end.start()] if end else text
+    network_restricted = "No network restrictions" not in text
+
+    # Locate every row label in order; a missing label is skipped without moving the cursor
+    found, cursor = [], max(text.find("Important Questions"), 0)
+    for index, pattern in enumerate(LABEL_PATTERNS):
+        match = pattern.search(text, cursor)
+        if not match:
+            continue
+        if SBC_ROWS[index][0] in OPTIONAL_ROWS:
+            following = next((LABEL_PATTERNS[i].search(text, cursor) for i in range(index + 1, len(SBC_ROWS))
+                              if SBC_ROWS[i][0] not in OPTIONAL_ROWS), None)
+            if following is None or match.start() > following.start():
+                continue
+        found.append((index, match))
+        cursor = match.end()
+
+    facts = []
+    source = os.path.basename(file_path)
+    plan = plan_name(file_path)
+    for position, (index, match) in enumerate(found):
+        value_end = found[position + 1][1].start() if position + 1 < len(found) else len(text)
+        value = text[match.end():value_end]
+        for header in PAGE_HEADERS:
+            value = header.sub(" ", value)
+        heading = EVENT_HEADING.search(value)
+        if heading:
+            value = value[:heading.start()]
+        value = re.sub(r"^\s*\([^)]*\)", "", " ".join(value.split()))
+        notes = NOTES_START.search(value)
+        cost, note = (value[:notes.start()], value[notes.start():]) if notes and notes.start() > 0 else (value, "")
+        # A row split by a page break can print part of its cost after the limitations
+        moved = COST_PARTS.findall(note)
+        if moved:
+            cost = " ".join([cost] + moved)
+            note = COST_PARTS.sub(" ", note)
+        cost, note = _clean(" ".join(cost.split())), _clean(" ".join(note.split()))
+        if not cost:
+            continue
+        page = max((page for start, page in page_starts if start <= match.start()), default=1)
+        # Plans without a network charge members the same wherever they are treated
+        facts.append(PlanFact(plan, SBC_ROWS[index][0], cost, None if network_restricted else cost, note, source, page))
+    return facts
+
+
+class PlanFactStore:
+    """Benefit facts of every plan summary, indexed by plan and benefit.
+
+    Built once per snapshot generation and never changed, like the collections.
+    """
+
+    def __init__(self, by_source: Optional[Dict[str, List[PlanFact]]] = None):
+        self.by_source: Dict[str, List[PlanFact]] = by_source or {}
+        # plan -> benefit -> fact
+        self.index: Dict[str, Dict[str, PlanFact]] = {}
+        for facts in self.by_source.values():
+            for fact in facts:
+                self.index.setdefault(fact.plan, {})[fact.benefit] = fact
+        # Words that tell plans apart; words every plan shares ("America's Choice") don't
+        words = {plan: set(normalize_query(plan).split()) for plan in self.index}
+        shared = set.intersection(*words.values()) if len(words) > 1 else set()
+        self.plan_words = {plan: plan_words - shared for plan, plan_words in words.items()}
+        # Ways of naming one plan unambiguously: its amount and tier together ("5000 bronze", "bronze 5000"), or the
+        # tier next to "plan" or the shared name ("bronze plan", "america's choice bronze")
+        self.plan_names: Dict[str, List[str]] = {}
+        for plan in self.index:
+            words = normalize_query(plan).split()
+            prefix = " ".join(word for word in words if word in shared)
+            name = " ".join(word for word in words if word not in shared)
+            tiers = [word for word in name.split() if not word.isdigit()]
+            names = {name, " ".join(reversed(name.split()))}
+            names |= {f"{tier} {suffix}" for tier in tiers for suffix in ("plan", "plans")}
+            if prefix:
+                names |= {f"{prefix} {tier}" for tier in tiers} | {f"{prefix} {name}"}
+            self.plan_names[plan] = sorted(names)
+
+    def __len__(self):
+        return sum(len(facts) for facts in self.by_source.values())
+
+    def match_plans(self, question: str) -> List[str]:
+        """Plans the question names, best match first; numbers shared by plans match all of them"""
+        words = set(normalize_query(question).split())
+        scores = {plan: len(plan_words & words) for plan, plan_words in self.plan_words.items()}
+        best = max(scores.values(), default=0)
+        return sorted(plan for plan, score in scores.items() if score == best and best > 0)
+
+    def named_plans(self, question: str) -> List[str]:
+        """Plans the question names unambiguously (see plan_names); a bare "gold" or "5000" doesn't"""
+        text = f" {normalize_query(question)} "
+        return sorted(plan for plan, names in self.plan_names.items() if any(f" {name} " in text for name in names))
+
+    @staticmethod
+    def match_benefits(question: str, strict: bool = False) -> List[str]:
+        """Benefits the question asks about, in summary order; strict ignores AMBIGUOUS_PHRASES"""
+        text = f" {normalize_query(question)} "
+        benefits = set()
+        for phrase, phrase_benefits in BENEFIT_PHRASES:
+            if f" {phrase} " in text:
+                if not (strict and phrase in AMBIGUOUS_PHRASES):
+                    benefits.update(phrase_benefits)
+                # A longer phrase consumes its words, so shorter phrases inside it don't match too
+                text = text.replace(f" {phrase} ", " | ")
+        return [benefit for benefit, _, _ in SBC_ROWS if benefit in benefits]
+
+    def lookup(self, question: str, context: str = "") -> Tuple[List[str], List[PlanFact]]:
+        """The plans the question names and the facts for the benefits it asks about.
+
+        A plan or benefit the question doesn't name is taken from context (e.g. the previous
+        question). Nothing is returned unless one of them names a plan: benefit phrases alone
+        ("delivery", "network", "scan") are too common in trading questions to route on.
+        """
+        benefits = self.match_benefits(question) or self.match_benefits(context)
+        if not benefits or not self.index:
+            return [], []
+        plans = self.match_plans(question) or self.match_plans(context)
+        if not plans:
+            return [], []
+        facts = [self.index[plan][benefit] for plan in plans for benefit in benefits if benefit in self.index[plan]]
+        return plans, facts
+
+    def direct_answer(self, question: str) -> Optional[str]:
+        """Answer a plain lookup from the index, or None.
+
+        Only questions that name a plan unambiguously and ask about a benefit in words that
+        mean nothing else are answered here; borderline matches go to the model with the rows.
+        """
+        if REASONING.search(question.lower()):
+            return None
+        plans = self.named_plans(question)
+        benefits = self.match_benefits(question, strict=True)
+        facts = [self.index[plan][benefit] for plan in plans for benefit in benefits if benefit in self.index[plan]]
+        if not facts or len(facts) > DIRECT_ANSWER_MAX_FACTS:
+            return None
+        lines = []
+        for plan in plans:
+            plan_facts = [fact for fact in facts if fact.plan == plan]
+            if not plan_facts:
+                continue
+            lines.append(f"Here's what the {plan} plan says:")
+            for fact in plan_facts:
+                cost = fact.in_network
+                if fact.out_of_network and fact.out_of_network != fact.in_network:
+                    cost = f"{fact.in_network} in-network, {fact.out_of_network} out-of-network"
+                note = f" ({fact.notes})" if fact.notes else ""
+                lines.append(f"- {fact.benefit}: {cost}{note}")
+            sources = sorted({(fact.source, fact.page) for fact in plan_facts})
+            lines.append("Source: " + "; ".join(f"{source}, page {page}" for source, page in sources))
+            lines.append("")
+        return "\n".join(lines).strip()
+
+    def save(self, path: str):
+        with open(path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump({key: [fact._asdict() for fact in facts] for key, facts in self.by_source.items()}, file)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path: str) -> 'PlanFactStore':
+        """Load saved facts; a missing file is an empty store"""
+        if not os.path.exists(path):
+            return cls()
+        with open(path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        return cls({key: [PlanFact(**fact) for fact in facts] for key, facts in data.items()})
@@ -0,0 +1,154 @@
+import os
+from functools import lru_cache
+from typing import List, Tuple
+from conversation_store import HISTORY_TOKEN_BUDGET, Message
+from metrics import PROMPT_CHARS, PROMPT_TOKENS, PROMPT_TRUNCATIONS
+from retrieval import SUBWORD_PATTERN, estimate_tokens
+
+# Estimated tokens of the whole prompt: instructions, question, history and retrieved context
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 6000))
+
+# A chunk is cut to fit the remaining budget only if at least this many tokens of it fit
+MIN_TRUNCATED_TOKENS = 32
+
+# Persona and guidelines: identical in every prompt, and first, so providers can cache the prefix
+STATIC_PREFIX = """You are Angel, a friendly and helpful customer support assistant for Angel One, a trading and investment platform.
+You should respond in a conversational, helpful tone as if you're chatting with a customer.
+
+Use the knowledge sources below to inform your answers, but respond naturally like a human customer service agent would.
+Don't mention that you're using "knowledge sources" or "information provided" - just incorporate the knowledge naturally.
+
+Additionally, you have access to the Angel One support webpage: https://www.angelone.in/support
+
+Important guidelines:
+- First check if the answer is in the document data, then check webpage data
+- If you can't find the answer in any of the provided sources, clearly state that you don't have that specific information
+- Be concise and friendly in your responses
+- Use a conversational tone with occasional friendly phrases like "I'd be happy to help with that" or "Great question!"
+- If you're not 100% sure about something, say "Based on what I understand..." rather than "I don't know"
+- Personalize your responses by occasionally referring to the user's question
+- Offer to provide more information or help with related questions
+- Never make up information - if you truly don't know, say "I don't have that specific information right now, but I'd be happy to help you find out"
+- When appropriate, mention that users can find more details on the Angel One support page: https://www.angelone.in/support
+- NEVER include invalid URLs like 'https://www.angelone.in/support.\\n\\nIs' - always use the correct URL: https://www.angelone.in/support
+- When referring to the support page, use the exact URL: https://www.angelone.in/support (without any trailing periods or characters)
+- For questions about processes (like account creation, trading, etc.), always provide detailed step-by-step instructions with numbered steps
+- When explaining multi-step processes, include all necessary details like document requirements, verification steps, and timeframes
+- If the user is asking about creating an account, provide comprehensive steps from visiting the website to first login
+- Always mention important requirements like Aadhaar-mobile linking, document needs, and processing times
+- Format your responses with clear paragraph breaks and numbered steps for better readability
+- You are a customer support assistant for Angel One, so you should only answer questions related to Angel One's services and financial trading
+- If the user asks about topics unrelated to Angel One or financial trading (like sports, entertainment, politics, etc.), politely explain that you're an Angel One assistant and can only help with questions about Angel One's services and financial trading
+- IMPORTANT: If the user's question refers to previous messages in the conversation, make sure to use that context in your answer"""
+
+DOCUMENTS_HEADING = "\n\nDocument data:\n"
+WEBPAGES_HEADING = "\n\nWebpage data:\n"
+HISTORY_HEADING = "\n\nPrevious conversation:\n"
+QUESTION_HEADING = "\n\nCustomer question: "
+CHUNK_SEPARATOR = "\n\n"
+
+
+@lru_cache(maxsize=8192)
+def chunk_tokens(chunk: str) -> int:
+    """Token estimate of a retrieved chunk; popular chunks come back in many prompts"""
+    return estimate_tokens(chunk)
+
+
+@lru_cache(maxsize=1024)
+def truncate_to_tokens(text: str, tokens: int) -> str:
+    """The longest prefix of text estimated at no more than tokens, cut at a word boundary when possible"""
+    end = 0
+    for count, match in enumerate(SUBWORD_PATTERN.finditer(text), 1):
+        if count > tokens:
+            break
+        end = match.end()
+    else:
+        return text
+    cut = text.rfind(" ", 0, end + 1)
+    return text[:cut if cut > end // 2 else end].rstrip()
+
+
+def fill(chunks: List[str], budget: int, part: str) -> Tuple[List[str], int]:
+    """Take chunks in ranked order while they fit; the first that doesn't is cut to the remaining budget.
+
+    Returns the chunks and the tokens they use. The result depends only on the inputs, so
+    identical requests build identical prompts.
+    """
+    selected = []
+    used = 0
+    for chunk in chunks:
+        cost = chunk_tokens(chunk)
+        if used + cost <= budget:
+            selected.append(chunk)
+            used += cost
+            continue
+        if budget - used >= MIN_TRUNCATED_TOKENS:
+            chunk = truncate_to_tokens(chunk, budget - used)
+            selected.append(chunk)
+            used += estimate_tokens(chunk)
+        PROMPT_TRUNCATIONS.inc(part=part)
+        break
+    return selected, used
+
+
+class PromptBuilder:
+    """Builds model prompts within a fixed token budget.
+
+    The static prefix is formatted and measured once. Each request then fills what is left of
+    the budget in priority order: the question, the most recent history (also capped by
+    HISTORY_TOKEN_BUDGET), document chunks, and webpage chunks, in that order. Parts are
+    collected in a list and joined once.
+    """
+
+    def __init__(self, token_budget: int = PROMPT_TOKEN_BUDGET, history_budget: int = HISTORY_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self.history_budget = history_budget
+        self.prefix = STATIC_PREFIX
+        self.prefix_tokens = estimate_tokens(self.prefix)
+        self.heading_tokens = sum(estimate_tokens(heading) for heading in
+                                  (DOCUMENTS_HEADING, WEBPAGES_HEADING, HISTORY_HEADING, QUESTION_HEADING))
+
+    def history_lines(self, history: List[Message], budget: int) -> Tuple[List[str], int]:
+        """Formatted most recent messages, oldest first, that fit the budget"""
+        lines = []
+        used = 0
+        for message in reversed(history):
+            line = f"{message.role.capitalize()}: {message.content}"
+            cost = estimate_tokens(line)
+            if used + cost > budget:
+                PROMPT_TRUNCATIONS.inc(part="history")
+                break
+            lines.append(line)
+            used += cost
+        lines.reverse()
+        return lines, used
+
+    def build(self, query: str, history: List[Message], document_chunks: List[str], webpage_chunks: List[str]) -> str:
+        """Build the prompt for a question from its history and retrieved context"""
+        remaining = self.token_budget - self.prefix_tokens - self.heading_tokens
+
+        question = query
+        if estimate_tokens(question) > remaining:
+            question = truncate_to_tokens(question, max(remaining, 0))
+            PROMPT_TRUNCATIONS.inc(part="question")
+        remaining -= estimate_tokens(question)
+
+        lines, used = self.history_lines(history, min(self.history_budget, remaining))
+        remaining -= used
+        documents, used = fill(document_chunks, remaining, "documents")
+        remaining -= used
+        webpages, used = fill(webpage_chunks, remaining, "webpages")
+        remaining -= used
+
+        parts = [self.prefix, DOCUMENTS_HEADING, CHUNK_SEPARATOR.join(documents),
+                 WEBPAGES_HEADING, CHUNK_SEPARATOR.join(webpages)]
+        if lines:
+            parts += [HISTORY_HEADING, "\n".join(lines)]
+        else:
+            remaining += estimate_tokens(HISTORY_HEADING)
+        parts += [QUESTION_HEADING, question]
+        prompt = "".join(parts)
+        PROMPT_CHARS.observe(len(prompt))
+        # Parts are separated by whitespace, so their estimates add up to the prompt's
+        PROMPT_TOKENS.observe(self.token_budget - remaining)
+        return prompt
@@ -1,137 +1,316 @@
-from typing import Dict
-from config import collection, model, documents_data
-from document_processor import DocumentProcessor
+from contextlib import aclosing
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from answer_cache import AnswerCache
+from conversation_store import Message, create_conversation_store
+from config import get_model, RETRIEVAL_TOP_K
+from knowledge_base import KnowledgeBase, REFRESH_INTERVAL, SNAPSHOT_POLL_INTERVAL, Snapshot
+from llm import AsyncLLMClient
+from metrics import (CONTEXT_SECONDS, CORPUS_CHUNKS, ERRORS, LIVE_CONVERSATIONS, LLM_CIRCUIT_OPEN, LLM_QUEUE_DEPTH,
+                     LLM_RUNNING, LLM_SECONDS, PLAN_FACT_ROUTES, SNAPSHOT_GENERATION, timed)
+from plan_facts import PLAN_FACT_ANSWERS
+from prompt_builder import PromptBuilder
+from scheduler import LLMScheduler, LLMUnavailable
+from vector_store import HashingEmbedder
+import threading
+import time
 import uuid
 
+NO_DATA_ANSWER = "I'm sorry, but I don't have enough information to answer your question about Angel One's services. Is there something else I can help you with?"
+ERROR_ANSWER = "I'm sorry, I encountered an error while processing your question. Please try again or contact our support team for assistance."
+
 class RAGSystem:
-    def __init__(self):
-        # Initialize the complete context variable
-        self.complete_context = ""
-        # Dictionary to store conversation history: {conversation_id: [messages]}
-        self.conversations = {}
-        # Load knowledge base and context during initialization
-        self.initialize_knowledge_base()
+    def __init__(self, initialize: bool = True):
+        """Set up the system; with initialize=False the knowledge base is left for initialize() to load"""
+        # Conversation histories with LRU/TTL eviction: {conversation_id: [messages]}
+        self.conversations = create_conversation_store()
+        # On-disk snapshot of the ingested corpus
+        self.knowledge_base = KnowledgeBase()
+        # Non-blocking access to the model for the async answer path; the model is created on first use
+        self.llm = AsyncLLMClient(loader=get_model)
+        # Coalescing, queueing, load shedding and the circuit breaker in front of self.llm
+        self.scheduler = LLMScheduler(self.llm)
+        # Prompt assembly within the model's token budget, around a precomputed instruction prefix
+        self.prompt_builder = PromptBuilder()
+        # Answers to standalone questions, reused while the knowledge base is unchanged
+        self.answer_cache = AnswerCache(embedder=getattr(self.knowledge_base.snapshot.web, 'embedder', None) or HashingEmbedder())
+        # Set to stop the scheduled refreshes
+        self.stop_refreshing = threading.Event()
+        # Set once the knowledge base is loaded and the system can answer
+        self.ready = threading.Event()
+        if initialize:
+            self.initialize()
+        
+        CORPUS_CHUNKS.set_function(lambda: self.knowledge_base.snapshot.web.count(), collection="web")
+        CORPUS_CHUNKS.set_function(lambda: self.knowledge_base.snapshot.documents.count(), collection="documents")
+        SNAPSHOT_GENERATION.set_function(lambda: self.knowledge_base.generation)
+        LIVE_CONVERSATIONS.set_function(lambda: len(self.conversations))
+        LLM_QUEUE_DEPTH.set_function(lambda: self.scheduler.queued)
+        LLM_RUNNING.set_function(lambda: self.scheduler.running)
+        LLM_CIRCUIT_OPEN.set_function(lambda: float(self.scheduler.breaker.state == "open"))
     
+    def initialize(self):
+        """Load or build the knowledge base, start scheduled refreshes and mark the system ready"""
+        self.initialize_knowledge_base()
+        if REFRESH_INTERVAL > 0:
+            self.schedule_refreshes(REFRESH_INTERVAL)
+        if SNAPSHOT_POLL_INTERVAL > 0:
+            self.follow_snapshots(SNAPSHOT_POLL_INTERVAL)
+        self.ready.set()
+
     def initialize_knowledge_base(self):
-        """Initialize the knowledge base by scraping and processing documents"""
-        # Only initialize if the collection is empty
-        if collection.count() == 0:
-            print("Collection is empty. Scraping and processing documents...")
-            DocumentProcessor.scrape_and_process_documents()
-            print(f"Documents processed. Collection count: {collection.count()}")
+        """Load the knowledge base snapshot, or build it by scraping and processing documents"""
+        if self.knowledge_base.load():
+            return
         
-        # Load all documents into the complete context
-        self.load_complete_context()
+        print("No usable snapshot found. Scraping and processing documents...")
+        self.knowledge_base.refresh()
+        snapshot = self.knowledge_base.snapshot
+        print(f"Documents processed. Collection count: {snapshot.web.count()}, "
+              f"document count: {snapshot.documents.count()}")
     
-    def load_complete_context(self):
-        """Load all documents from the collection into the complete context"""
+    def refresh_knowledge_base(self) -> Optional[Dict[str, int]]:
+        """Re-fetch sources, rebuild the ones that changed and swap the new snapshot in.
+        
+        Returns None when a refresh is already running.
+        """
+        generation = self.knowledge_base.generation
         try:
-            # Get all documents from the collection
-            results = collection.get();
-            
-            if results and results['documents'] and results['documents'][0]:
-                # Join all documents into a single string
-                self.complete_context = " ".join(results['documents'][0])
-                print(f"Loaded {len(results['documents'][0])} documents into complete context")
-            else:
-                print("No documents found in collection")
+            stats = self.knowledge_base.refresh()
         except Exception as e:
-            print(f"Error loading complete context: {e}")
+            print(f"Error refreshing knowledge base: {e}")
+            ERRORS.inc(stage="refresh")
+            return None
+        if self.knowledge_base.generation != generation:
+            self.answer_cache.invalidate()
+        return stats
+
+    def start_refresh(self) -> bool:
+        """Refresh the knowledge base on a background thread; returns False if one is already running"""
+        if self.knowledge_base.refreshing:
+            return False
+        threading.Thread(target=self.refresh_knowledge_base, name="kb-refresh", daemon=True).start()
+        return True
+
+    def schedule_refreshes(self, interval: float):
+        """Refresh the knowledge base every interval seconds until stop_refreshing is set"""
+        def run():
+            while not self.stop_refreshing.wait(interval):
+                self.refresh_knowledge_base()
+        threading.Thread(target=run, name="kb-refresh-schedule", daemon=True).start()
+        print(f"Refreshing the knowledge base every {interval:g}s")
+
+    def follow_snapshots(self, interval: float):
+        """Every interval seconds, load the snapshot if another worker process has written a newer one"""
+        def run():
+            while not self.stop_refreshing.wait(interval):
+                generation = self.knowledge_base.generation
+                try:
+                    self.knowledge_base.reload_if_changed()
+                except Exception as e:
+                    print(f"Error reloading knowledge base: {e}")
+                if self.knowledge_base.generation != generation:
+                    self.answer_cache.invalidate()
+        threading.Thread(target=run, name="kb-follow", daemon=True).start()
+    
+    def retrieve_context(self, query: str, snapshot: Optional[Snapshot] = None,
+                         document_hits: Optional[List[str]] = None) -> Tuple[List[str], List[str]]:
+        """Retrieve the best matching document and webpage chunks, in ranked order.
+        
+        document_hits replaces the document search, e.g. with matching plan facts. The prompt
+        builder decides how many of them fit the token budget.
+        """
+        snapshot = snapshot or self.knowledge_base.snapshot
+        if document_hits is None:
+            document_hits = snapshot.documents.query(query, RETRIEVAL_TOP_K)['documents'][0]
+        webpage_hits = snapshot.web.query(query, RETRIEVAL_TOP_K)['documents'][0]
+        return document_hits, webpage_hits
     
     def get_or_create_conversation(self, conversation_id=None):
         """Get an existing conversation or create a new one"""
-        if conversation_id and conversation_id in self.conversations:
-            return conversation_id, self.conversations[conversation_id]
-        
-        # Create a new conversation ID
-        new_id = str(uuid.uuid4())
-        self.conversations[new_id] = []
-        return new_id, self.conversations[new_id]
+        return self.conversations.get_or_create(conversation_id)
 
     def clear_conversations(self, conversation_ids):
-        """Clear multiple conversation histories"""
-        results = {}
-        for conversation_id in conversation_ids:
-            if conversation_id in self.conversations:
-                self.conversations[conversation_id] = []
-                results[conversation_id] = True
-            else:
-                results[conversation_id] = False
-        return results
+        """Delete multiple conversation histories"""
+        return {conversation_id: self.conversations.delete(conversation_id) for conversation_id in conversation_ids}
+
+    def retrieve_for_question(self, query: str, history: List[Message], snapshot: Snapshot) -> Tuple[List[str], List[str]]:
+        """Retrieve context for the question; includes the previous question so follow-ups still match.
+        
+        Questions about the benefits of a plan they name unambiguously get only the matching
+        rows of the plan fact index as document data, instead of document chunks. When the plan
+        is named only by a bare word ("gold", "5000"), the rows go ahead of the document chunks.
+        """
+        previous_questions = [msg.content for msg in history if msg.role == 'user']
+        previous = " ".join(previous_questions[-1:])
+        search_text = " ".join(previous_questions[-1:] + [query])
+        _, facts = snapshot.plan_facts.lookup(query, previous)
+        if not facts:
+            return self.retrieve_context(search_text, snapshot)
+        rows = [fact.as_text() for fact in facts]
+        if snapshot.plan_facts.named_plans(query) or snapshot.plan_facts.named_plans(previous):
+            PLAN_FACT_ROUTES.inc(route="rows")
+            return self.retrieve_context(search_text, snapshot, document_hits=rows)
+        PLAN_FACT_ROUTES.inc(route="rows_and_documents")
+        document_hits = snapshot.documents.query(search_text, RETRIEVAL_TOP_K)['documents'][0]
+        return self.retrieve_context(search_text, snapshot, document_hits=rows + document_hits)
+
+    def plan_fact_answer(self, query: str, snapshot: Snapshot) -> Optional[str]:
+        """Answer a lookup that names a plan and a benefit straight from the plan fact index"""
+        if not PLAN_FACT_ANSWERS:
+            return None
+        answer = snapshot.plan_facts.direct_answer(query)
+        if answer is not None:
+            PLAN_FACT_ROUTES.inc(route="direct")
+        return answer
+
+    def cached_answer(self, query: str, history: List[Message], chunks: List[str]) -> Optional[str]:
+        """Look up a cached answer; follow-ups depend on the conversation, so only first questions are cached"""
+        if history:
+            return None
+        return self.answer_cache.get(query, chunks)
+
+    def cache_answer(self, query: str, history: List[Message], chunks: List[str], answer: str, started: float):
+        """Cache the answer to a standalone question along with how long it took"""
+        if not history and answer:
+            self.answer_cache.put(query, chunks, answer, time.perf_counter() - started)
+
+    def prepare_answer(self, query: str, history: List[Message],
+                       snapshot: Snapshot) -> Tuple[Optional[str], Optional[str], List[str]]:
+        """Answer from the plan fact index or the answer cache, or else build the prompt for the model.
+
+        Returns (answer without a model call or None, prompt or None, retrieved chunks).
+        """
+        with timed(CONTEXT_SECONDS, "context"):
+            # Direct plan lookups are answered from the fact index, like a cache hit
+            cached = self.plan_fact_answer(query, snapshot)
+            if cached is not None:
+                return cached, None, []
+            document_chunks, webpage_chunks = self.retrieve_for_question(query, history, snapshot)
+            chunks = document_chunks + webpage_chunks
+            cached = self.cached_answer(query, history, chunks)
+            if cached is not None:
+                return cached, None, chunks
+            return None, self.prompt_builder.build(query, history, document_chunks, webpage_chunks), chunks
+
+    def has_knowledge(self, snapshot: Optional[Snapshot] = None) -> bool:
+        """Whether any documents or webpages have been ingested"""
+        snapshot = snapshot or self.knowledge_base.snapshot
+        return snapshot.web.count() > 0 or snapshot.documents.count() > 0
 
     def answer_question(self, query: str, conversation_id=None) -> Dict:
         """Generate an answer using document data, webpage data, and conversation history"""
+        conv_id = None
         try:
             # Get or create conversation history
-            conv_id, conversation = self.get_or_create_conversation(conversation_id)
-            
-            # Add the user's question to the conversation history
-            conversation.append({"role": "user", "content": query})
-            
+            conv_id, history = self.get_or_create_conversation(conversation_id)
+
+            # Read one snapshot for the whole answer, even if a refresh swaps in a new one meanwhile
+            snapshot = self.knowledge_base.snapshot
+
             # Check if we have any data to work with
-            if not documents_data and not self.complete_context:
-                answer = "I'm sorry, but I don't have enough information to answer your question about Angel One's services. Is there something else I can help you with?"
-                conversation.append({"role": "assistant", "content": answer})
-                return {"answer": answer, "conversation_id": conv_id}
-            
-            # Format conversation history for the prompt
-            conversation_text = ""
-            if conversation:
-                conversation_text = "\n\nPrevious conversation:\n"
-                for msg in conversation[:-1]:  # Exclude the current question
-                    conversation_text += f"{msg['role'].capitalize()}: {msg['content']}\n"
-            
-            # Prepare the prompt with both data sources and conversation history
-            prompt = f"""You are Angel, a friendly and helpful customer support assistant for Angel One, a trading and investment platform. 
-            You should respond in a conversational, helpful tone as if you're chatting with a customer.
-            
-            Use the following knowledge sources to inform your answers, but respond naturally like a human customer service agent would.
-            Don't mention that you're using "knowledge sources" or "information provided" - just incorporate the knowledge naturally.
-            
-            Document data: {documents_data}
-            
-            Webpage data: {self.complete_context}
-            {conversation_text}
-            
-            Additionally, you have access to the Angel One support webpage: https://www.angelone.in/support
-            
-            Important guidelines:
-            - First check if the answer is in the document data, then check webpage data
-            - If you can't find the answer in any of the provided sources, clearly state that you don't have that specific information
-            - Be concise and friendly in your responses
-            - Use a conversational tone with occasional friendly phrases like "I'd be happy to help with that" or "Great question!"
-            - If you're not 100% sure about something, say "Based on what I understand..." rather than "I don't know"
-            - Personalize your responses by occasionally referring to the user's question
-            - Offer to provide more information or help with related questions
-            - Never make up information - if you truly don't know, say "I don't have that specific information right now, but I'd be happy to help you find out"
-            - When appropriate, mention that users can find more details on the Angel One support page: https://www.angelone.in/support
-            - NEVER include invalid URLs like 'https://www.angelone.in/support.\n\nIs' - always use the correct URL: https://www.angelone.in/support
-            - When referring to the support page, use the exact URL: https://www.angelone.in/support (without any trailing periods or characters)
-            - For questions about processes (like account creation, trading, etc.), always provide detailed step-by-step instructions with numbered steps
-            - When explaining multi-step processes, include all necessary details like document requirements, verification steps, and timeframes
-            - If the user is asking about creating an account, provide comprehensive steps from visiting the website to first login
-            - Always mention important requirements like Aadhaar-mobile linking, document needs, and processing times
-            - Format your responses with clear paragraph breaks and numbered steps for better readability
-            - You are a customer support assistant for Angel One, so you should only answer questions related to Angel One's services and financial trading
-            - If the user asks about topics unrelated to Angel One or financial trading (like sports, entertainment, politics, etc.), politely explain that you're an Angel One assistant and can only help with questions about Angel One's services and financial trading
-            - IMPORTANT: If the user's question refers to previous messages in the conversation, make sure to use that context in your answer
-            
-            Customer question: {query}"""
-            
-            response = model.generate_content(prompt)
+            if not self.has_knowledge(snapshot):
+                return self.record_answer(conv_id, query, NO_DATA_ANSWER)
+
+            started = time.perf_counter()
+            cached, prompt, chunks = self.prepare_answer(query, history, snapshot)
+            if cached is not None:
+                return self.record_answer(conv_id, query, cached)
+
+            with timed(LLM_SECONDS, "llm"):
+                response = self.llm.model.generate_content(prompt)
             answer = response.text.strip()
+            self.cache_answer(query, history, chunks, answer, started)
+            return self.record_answer(conv_id, query, answer)
+
+        except Exception as e:
+            return self.error_answer(e, query, conversation_id, conv_id)
+
+    async def answer_question_async(self, query: str, conversation_id=None) -> Dict:
+        """Same as answer_question, but awaits the model through the scheduler instead of blocking the event loop.
+
+        Raises LLMUnavailable when the call is shed, so the caller can ask the client to retry.
+        """
+        conv_id = None
+        try:
+            conv_id, history = self.get_or_create_conversation(conversation_id)
+            snapshot = self.knowledge_base.snapshot
             
-            # Add the assistant's response to the conversation history
-            conversation.append({"role": "assistant", "content": answer})
+            if not self.has_knowledge(snapshot):
+                return self.record_answer(conv_id, query, NO_DATA_ANSWER)
             
-            return {"answer": answer, "conversation_id": conv_id}
+            started = time.perf_counter()
+            cached, prompt, chunks = self.prepare_answer(query, history, snapshot)
+            if cached is not None:
+                return self.record_answer(conv_id, query, cached)
             
-        except Exception as e:
-            print(f"Error occurred while generating answer: {e}")
-            error_msg = "I'm sorry, I encountered an error while processing your question. Please try again or contact our support team for assistance."
+            with timed(LLM_SECONDS, "llm"):
+                answer = await self.scheduler.generate(prompt)
+            self.cache_answer(query, history, chunks, answer, started)
+            return self.record_answer(conv_id, query, answer)
             
-            # Add error response to conversation if it exists
-            if conversation_id in self.conversations:
-                self.conversations[conversation_id].append({"role": "assistant", "content": error_msg})
-            
-            return {"answer": error_msg, "conversation_id": conv_id if 'conv_id' in locals() else str(uuid.uuid4())}
\ No newline at end of file
+        except LLMUnavailable:
+            raise
+        except Exception as e:
+            return self.error_answer(e, query, conversation_id, conv_id)
+
+    async def answer_question_stream(self, query: str, conversation_id=None) -> AsyncIterator[Dict]:
+        """Stream an answer as events: "start" (with conversation_id), "token"s, then "done" or "error".
+        
+        The question and the assembled answer are only added to the conversation once the
+        stream finishes, so an abandoned stream leaves the history untouched.
+        """
+        conv_id, history = self.get_or_create_conversation(conversation_id)
+        yield {"event": "start", "conversation_id": conv_id}
+        snapshot = self.knowledge_base.snapshot
+        
+        if not self.has_knowledge(snapshot):
+            self.record_answer(conv_id, query, NO_DATA_ANSWER)
+            yield {"event": "token", "text": NO_DATA_ANSWER}
+            yield {"event": "done", "answer": NO_DATA_ANSWER}
+            return
+        
+        parts = []
+        try:
+            started = time.perf_counter()
+            cached, prompt, chunks = self.prepare_answer(query, history, snapshot)
+            if cached is not None:
+                parts.append(cached)
+                yield {"event": "token", "text": cached}
+            else:
+                with timed(LLM_SECONDS, "llm"):
+                    async with self.scheduler.slot():
+                        # Closed here, inside the slot, when the client disconnects, rather than by the
+                        # event loop's generator finalizer after the slot is released
+                        async with aclosing(self.llm.stream(prompt)) as stream:
+                            async for text in stream:
+                                parts.append(text)
+                                yield {"event": "token", "text": text}
+                self.cache_answer(query, history, chunks, "".join(parts).strip(), started)
+        except LLMUnavailable as e:
+            yield {"event": "error", "message": str(e), "retry_after": e.retry_after}
+            return
+        except Exception as e:
+            print(f"Error occurred while streaming answer: {e}")
+            ERRORS.inc(stage="stream")
+            yield {"event": "error", "message": ERROR_ANSWER}
+            return
+        
+        answer = "".join(parts).strip()
+        self.record_answer(conv_id, query, answer)
+        yield {"event": "done", "answer": answer}
+
+    def record_answer(self, conv_id: str, query: str, answer: str) -> Dict:
+        """Add the question and the assistant's response to the conversation history and build the response"""
+        self.conversations.append(conv_id, Message("user", query), Message("assistant", answer))
+        return {"answer": answer, "conversation_id": conv_id}
+
+    def error_answer(self, error: Exception, query: str, conversation_id=None, conv_id=None) -> Dict:
+        """Log an error and build the apology response"""
+        print(f"Error occurred while generating answer: {error}")
+        ERRORS.inc(stage="answer")
+        
+        # Add error response to conversation if it exists
+        if conversation_id and conversation_id == conv_id:
+            self.conversations.append(conversation_id, Message("user", query), Message("assistant", ERROR_ANSWER))
+        
+        return {"answer": ERROR_ANSWER, "conversation_id": conv_id or str(uuid.uuid4())}
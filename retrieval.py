@@ -0,0 +1,195 @@
+import bisect
+import math
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from chunk_store import PackedStrings, load_arrays, save_arrays
+
+# Lowercase alphanumeric runs; good enough for support articles and plan documents
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# Approximates subword tokenizers: letter runs of up to 6, digit runs of up to 3, and every other visible character
+SUBWORD_PATTERN = re.compile(r"[^\W\d_]{1,6}|\d{1,3}|\S")
+
+# Common English words that carry no retrieval signal
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i if in is it its
+me my of on or our so that the their then there these this to was we what when
+where which who why will with you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase terms, dropping stopwords"""
+    return [term for term in TOKEN_PATTERN.findall(text.lower()) if term not in STOPWORDS]
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate model token count for budgeting, without loading a tokenizer.
+
+    Counts are additive over whitespace-separated parts, so sections can be measured separately.
+    """
+    return len(SUBWORD_PATTERN.findall(text))
+
+
+MAGIC = b"BM25IX01"
+
+
+class BM25Index:
+    """Inverted index with Okapi BM25 scoring.
+
+    Built as dicts while documents are ingested. A saved index is memory-mapped back as flat
+    arrays instead: terms in sorted order, each term's start in the postings, and the postings'
+    document positions and term frequencies. Workers then share it through the page cache, and
+    it is turned back into dicts only if it is changed.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        # term -> {doc position: term frequency}
+        self.postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self.doc_lengths = []
+        self.total_length = 0
+        # The memory-mapped arrays of a loaded index, until it is changed; then postings hold it
+        self.terms: Optional[PackedStrings] = None
+        self.term_starts: Optional[np.ndarray] = None
+        self.doc_ids: Optional[np.ndarray] = None
+        self.term_frequencies: Optional[np.ndarray] = None
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def copy(self) -> "BM25Index":
+        """A copy that can be changed without affecting this one; loaded arrays are shared, never written"""
+        clone = BM25Index(self.k1, self.b)
+        clone.doc_lengths = self.doc_lengths if self.terms is not None else list(self.doc_lengths)
+        clone.total_length = self.total_length
+        clone.terms, clone.term_starts = self.terms, self.term_starts
+        clone.doc_ids, clone.term_frequencies = self.doc_ids, self.term_frequencies
+        for term, frequencies in self.postings.items():
+            clone.postings[term] = dict(frequencies)
+        return clone
+
+    def _thaw(self):
+        """Turn loaded arrays back into dicts before the index is changed"""
+        if self.terms is None:
+            return
+        starts = self.term_starts.tolist()
+        doc_ids = self.doc_ids.tolist()
+        frequencies = self.term_frequencies.tolist()
+        for row, term in enumerate(self.terms):
+            self.postings[term] = dict(zip(doc_ids[starts[row]:starts[row + 1]], frequencies[starts[row]:starts[row + 1]]))
+        self.doc_lengths = self.doc_lengths.tolist()
+        self.terms = self.term_starts = self.doc_ids = self.term_frequencies = None
+
+    def _term_postings(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Positions and frequencies of the documents containing term, or None"""
+        if self.terms is None:
+            frequencies = self.postings.get(term)
+            if not frequencies:
+                return None
+            return (np.fromiter(frequencies.keys(), dtype=np.int64, count=len(frequencies)),
+                    np.fromiter(frequencies.values(), dtype=np.float64, count=len(frequencies)))
+        row = bisect.bisect_left(self.terms, term)
+        if row == len(self.terms) or self.terms[row] != term:
+            return None
+        start, end = int(self.term_starts[row]), int(self.term_starts[row + 1])
+        return self.doc_ids[start:end], self.term_frequencies[start:end].astype(np.float64)
+
+    def add(self, texts: List[str]):
+        """Index texts, assigning them positions after the existing documents"""
+        self._thaw()
+        for text in texts:
+            position = len(self.doc_lengths)
+            terms = tokenize(text)
+            for term in terms:
+                frequencies = self.postings[term]
+                frequencies[position] = frequencies.get(position, 0) + 1
+            self.doc_lengths.append(len(terms))
+            self.total_length += len(terms)
+
+    def remove(self, positions):
+        """Drop documents at the given positions; later documents shift down to stay contiguous"""
+        removed = set(positions)
+        if not removed:
+            return
+        self._thaw()
+        remap = {}
+        kept_lengths = []
+        for position, length in enumerate(self.doc_lengths):
+            if position not in removed:
+                remap[position] = len(kept_lengths)
+                kept_lengths.append(length)
+
+        for term in list(self.postings):
+            frequencies = {remap[position]: tf for position, tf in self.postings[term].items() if position in remap}
+            if frequencies:
+                self.postings[term] = frequencies
+            else:
+                del self.postings[term]
+        self.doc_lengths = kept_lengths
+        self.total_length = sum(kept_lengths)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[int, float]]:
+        """Return up to k (position, score) pairs, best match first"""
+        doc_count = len(self.doc_lengths)
+        if doc_count == 0 or k <= 0:
+            return []
+
+        average_length = self.total_length / doc_count or 1.0
+        doc_lengths = np.asarray(self.doc_lengths, dtype=np.float64)
+        scores = np.zeros(doc_count)
+        for term in set(tokenize(query)):
+            postings = self._term_postings(term)
+            if postings is None:
+                continue
+            positions, tf = postings
+            df = len(positions)
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * doc_lengths[positions] / average_length)
+            scores[positions] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        # Every matching document scores above zero; ties go to the earlier position
+        matched = np.flatnonzero(scores)
+        top = matched[np.lexsort((matched, -scores[matched]))][:k]
+        return [(int(position), float(scores[position])) for position in top]
+
+    def save(self, path: str):
+        """Write the index as flat arrays to one file (see chunk_store.save_arrays)"""
+        if self.terms is not None:
+            terms, term_offsets = self.terms.packed()
+            term_lengths, term_starts = self.terms.lengths, self.term_starts
+            doc_ids, term_frequencies = self.doc_ids, self.term_frequencies
+        else:
+            sorted_terms = sorted(self.postings)
+            packed = PackedStrings()
+            packed.extend(sorted_terms)
+            terms, term_offsets = packed.packed()
+            term_lengths = packed.lengths
+            counts = np.fromiter((len(self.postings[term]) for term in sorted_terms), dtype=np.int64, count=len(sorted_terms))
+            term_starts = np.zeros(len(sorted_terms) + 1, dtype=np.int64)
+            np.cumsum(counts, out=term_starts[1:])
+            total = int(term_starts[-1])
+            doc_ids = np.fromiter((position for term in sorted_terms for position in self.postings[term]),
+                                  dtype=np.int32, count=total)
+            term_frequencies = np.fromiter((tf for term in sorted_terms for tf in self.postings[term].values()),
+                                           dtype=np.int32, count=total)
+        arrays = [("term_offsets", term_offsets), ("term_lengths", term_lengths), ("term_starts", term_starts),
+                  ("doc_ids", doc_ids), ("term_frequencies", term_frequencies),
+                  ("doc_lengths", np.asarray(self.doc_lengths, dtype=np.int32)),
+                  ("terms", np.frombuffer(terms, dtype=np.uint8))]
+        save_arrays(path, MAGIC, {"k1": self.k1, "b": self.b, "total_length": self.total_length}, arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """Memory-map a saved index; nothing is unpickled or copied into the process"""
+        header, arrays = load_arrays(path, MAGIC)
+        index = cls(header["k1"], header["b"])
+        index.terms = PackedStrings(memoryview(arrays["terms"]), arrays["term_offsets"], arrays["term_lengths"])
+        index.term_starts = arrays["term_starts"]
+        index.doc_ids = arrays["doc_ids"]
+        index.term_frequencies = arrays["term_frequencies"]
+        index.doc_lengths = arrays["doc_lengths"]
+        index.total_length = header["total_length"]
+        return index
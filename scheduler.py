@@ -0,0 +1,196 @@
+import asyncio
+import hashlib
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Optional
+from llm import LLM_MAX_CONCURRENCY
+from metrics import LLM_COALESCED, LLM_SHED
+
+# Requests allowed to wait for a free LLM slot; more are shed immediately
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", 64))
+# Seconds a request may spend waiting for and running its LLM call; requests that can't make it are shed
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", 30))
+# Consecutive failed LLM calls that open the circuit, and seconds it stays open before a trial call
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", 5))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", 30))
+
+# Weight of the newest call in the moving average of LLM call durations
+SERVICE_TIME_WEIGHT = 0.2
+
+
+class LLMUnavailable(Exception):
+    """The model was not called because it is overloaded or failing; served as 503 with Retry-After"""
+
+    def __init__(self, reason: str, retry_after: float):
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"The assistant is busy ({reason}); please retry in {self.retry_after}s")
+
+
+class CircuitBreaker:
+    """Fails fast after repeated upstream errors, then lets a single trial call through after a cooldown.
+
+    Closed: calls go through. Open: calls fail immediately. Half-open (cooldown over): one
+    call goes through; its success closes the circuit and its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "open" if self.clock() - self.opened_at < self.cooldown else "half_open"
+
+    def check(self):
+        """Raise LLMUnavailable if a call would be refused now"""
+        state = self.state
+        if state == "open":
+            raise LLMUnavailable("circuit_open", self.cooldown - (self.clock() - self.opened_at))
+        if state == "half_open" and self.trial_running:
+            raise LLMUnavailable("circuit_open", self.cooldown)
+
+    def before_call(self):
+        self.check()
+        if self.state == "half_open":
+            self.trial_running = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_running = False
+        # Failures of calls started before the circuit opened don't extend the cooldown
+        if self.state == "half_open" or (self.opened_at is None and self.failures >= self.failure_threshold):
+            print(f"Opening the LLM circuit for {self.cooldown:g}s after {self.failures} consecutive failures")
+            self.opened_at = self.clock()
+
+
+class LLMScheduler:
+    """Admission control in front of the LLM client.
+
+    Identical prompts already in flight share one upstream call. Other calls wait in a
+    bounded queue for one of max_concurrency slots, and are shed with LLMUnavailable when
+    the queue is full, when they could not finish before the deadline, or while the
+    circuit breaker is open. Runs on the event loop, so its counters need no locks.
+    """
+
+    def __init__(self, client, max_concurrency: int = LLM_MAX_CONCURRENCY, queue_size: int = LLM_QUEUE_SIZE,
+                 deadline: float = LLM_DEADLINE, breaker: Optional[CircuitBreaker] = None):
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self.deadline = deadline
+        self.breaker = breaker or CircuitBreaker()
+        self.slots = asyncio.Semaphore(max_concurrency)
+        # Calls waiting for a slot, and calls holding one
+        self.queued = 0
+        self.running = 0
+        # Moving average of call durations, used to predict queueing delay; 0 until a call completes
+        self.service_time = 0.0
+        # prompt digest -> the upstream call every identical request awaits
+        self.in_flight: Dict[str, asyncio.Task] = {}
+
+    def estimated_wait(self) -> float:
+        """Seconds a new request would wait for a slot, if every call takes the average time"""
+        if self.running < self.max_concurrency:
+            return 0.0
+        return (self.queued // self.max_concurrency + 1) * self.service_time
+
+    def check(self):
+        """Raise LLMUnavailable if a new call would be shed right now"""
+        try:
+            self.breaker.check()
+            if self.queued >= self.queue_size:
+                raise LLMUnavailable("queue_full", self.estimated_wait() or 1)
+            # Only a request that has to queue can miss the deadline because of other calls
+            wait = self.estimated_wait()
+            if wait > self.deadline:
+                raise LLMUnavailable("deadline", wait)
+        except LLMUnavailable as e:
+            LLM_SHED.inc(reason=e.reason)
+            raise
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one of the concurrency slots for an LLM call, waiting no longer than the deadline allows"""
+        self.check()
+        self.queued += 1
+        try:
+            # Leave time for the call itself, but never less than half the deadline for the wait
+            await asyncio.wait_for(self.slots.acquire(), self.deadline - min(self.service_time, self.deadline / 2))
+        except asyncio.TimeoutError:
+            LLM_SHED.inc(reason="deadline")
+            raise LLMUnavailable("deadline", self.estimated_wait())
+        finally:
+            self.queued -= 1
+
+        started = time.perf_counter()
+        self.running += 1
+        try:
+            try:
+                self.breaker.before_call()
+            except LLMUnavailable as e:
+                LLM_SHED.inc(reason=e.reason)
+                raise
+            try:
+                yield
+            except Exception:
+                self.breaker.record_failure()
+                raise
+            finally:
+                # A trial call that is cancelled (e.g. its stream client disconnected) records
+                # no result, but must not keep the half-open slot
+                self.breaker.trial_running = False
+            self.breaker.record_success()
+            # Capped at the deadline, so a single slow call (e.g. retried after a timeout) can't
+            # make every later request look hopeless
+            elapsed = min(time.perf_counter() - started, self.deadline)
+            self.service_time = elapsed if not self.service_time else (
+                SERVICE_TIME_WEIGHT * elapsed + (1 - SERVICE_TIME_WEIGHT) * self.service_time)
+        finally:
+            self.running -= 1
+            self.slots.release()
+
+    async def generate(self, prompt: str) -> str:
+        """Generate a completion, sharing the upstream call with identical prompts already in flight.
+
+        The prompt holds the question, the retrieved context and the conversation, so equal
+        prompts have equal answers.
+        """
+        key = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        task = self.in_flight.get(key)
+        if task is not None:
+            LLM_COALESCED.inc()
+        else:
+            task = asyncio.ensure_future(self._generate(prompt))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        # A caller that disconnects stops waiting without cancelling the call others share
+        return await asyncio.shield(task)
+
+    async def _generate(self, prompt: str) -> str:
+        async with self.slot():
+            return await self.client.generate(prompt)
+
+    def _finished(self, key: str, task: asyncio.Task):
+        self.in_flight.pop(key, None)
+        if not task.cancelled():
+            # Mark the error as retrieved even if every caller has gone away
+            task.exception()
+
+    def status(self) -> Dict:
+        return {"queued": self.queued, "running": self.running, "in_flight_prompts": len(self.in_flight),
+                "service_time_seconds": self.service_time, "circuit": self.breaker.state}
@@ -0,0 +1,230 @@
+import hashlib
+import json
+import os
+from functools import lru_cache
+from typing import List, Optional
+import numpy as np
+from chunk_store import ChunkStore
+from retrieval import tokenize
+
+
+@lru_cache(maxsize=65536)
+def _hash_feature(feature: str, dimension: int):
+    """Map a feature to a (column, sign) pair"""
+    digest = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+    return digest % dimension, 1.0 if (digest >> 63) & 1 else -1.0
+
+
+class HashingEmbedder:
+    """Deterministic feature-hashing embedder over unigrams and bigrams; needs no model download"""
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+        self.name = f"hashing-{dimension}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Return an (n, dimension) float32 matrix of L2-normalized embeddings"""
+        matrix = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            terms = tokenize(text)
+            features = terms + [f"{a} {b}" for a, b in zip(terms, terms[1:])]
+            for feature in features:
+                column, sign = _hash_feature(feature, self.dimension)
+                matrix[row, column] += sign
+        return _normalize(matrix)
+
+
+class SentenceTransformerEmbedder:
+    """Embedder backed by a locally installed sentence-transformers model"""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+        self.name = model_name
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Return an (n, dimension) float32 matrix of L2-normalized embeddings"""
+        embeddings = self.model.encode(list(texts), convert_to_numpy=True, normalize_embeddings=True)
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+
+def get_embedder(model_name: Optional[str] = None):
+    """Use the sentence-transformers model when available, otherwise the hashing embedder"""
+    if model_name:
+        try:
+            return SentenceTransformerEmbedder(model_name)
+        except Exception as e:
+            print(f"Could not load embedding model {model_name} ({e}); using hashing embedder")
+    return HashingEmbedder()
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _save_array(path: str, array: np.ndarray):
+    with open(path + '.tmp', 'wb') as file:
+        np.save(file, array)
+    os.replace(path + '.tmp', path)
+
+
+def _quantize(matrix: np.ndarray):
+    """Quantize rows to int8 with one float32 scale per row"""
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.round(matrix / scales[:, None]).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+class VectorStore:
+    """Collection that keeps chunk embeddings in one contiguous matrix and ranks them by cosine similarity"""
+
+    MATRIX_FILE = "embeddings.npy"
+    SCALES_FILE = "scales.npy"
+    HEADER_FILE = "store.json"
+    CHUNKS_FILE = "chunks.bin"
+
+    def __init__(self, embedder, quantize: bool = False):
+        self.embedder = embedder
+        self.quantize = quantize
+        # Texts, ids and source metadata (e.g. {"source": "plan.pdf", "page": 2}) in matrix row order
+        self.chunks = ChunkStore()
+        self.matrix = np.zeros((0, embedder.dimension), dtype=np.int8 if quantize else np.float32)
+        # Per-row dequantization scales, only used when quantize is set
+        self.scales = np.zeros(0, dtype=np.float32)
+
+    @property
+    def documents(self):
+        return self.chunks.texts
+
+    @property
+    def ids(self):
+        return self.chunks.ids
+
+    @property
+    def metadatas(self):
+        return self.chunks.metadatas
+
+    def count(self):
+        """Return the number of documents in the collection"""
+        return len(self.documents)
+
+    def empty(self) -> "VectorStore":
+        """Return a new empty collection with the same embedder and settings"""
+        return VectorStore(self.embedder, quantize=self.quantize)
+
+    def copy(self) -> "VectorStore":
+        """Return a copy that can be changed without affecting readers of this one.
+
+        The matrix is shared rather than copied: add and delete always build a new one.
+        """
+        clone = self.empty()
+        clone.matrix = self.matrix
+        clone.scales = self.scales
+        clone.chunks = self.chunks.copy()
+        return clone
+
+    def add(self, documents, ids=None, metadatas=None):
+        """Embed documents and append them to the matrix"""
+        if not documents:
+            return {"count": len(self.documents)}
+        embeddings = self.embedder.embed(documents)
+        if self.quantize:
+            embeddings, scales = _quantize(embeddings)
+            self.scales = np.concatenate([self.scales, scales])
+        # Concatenating also copies a memory-mapped matrix into memory before it grows
+        self.matrix = np.ascontiguousarray(np.concatenate([self.matrix, embeddings]))
+        self.chunks.add(documents, ids or self.chunks.new_ids(len(documents)), metadatas or [{} for _ in documents])
+        return {"count": len(self.documents)}
+
+    def delete(self, ids):
+        """Remove documents by id, keeping the embeddings of every other document"""
+        keep = self.chunks.delete(ids)
+        if keep.all():
+            return
+        self.matrix = np.ascontiguousarray(self.matrix[keep])
+        if self.quantize:
+            self.scales = self.scales[keep]
+
+    def get(self):
+        """Query the collection"""
+        return {
+            "documents": [self.documents] if self.documents else [[]]
+        }
+
+    def query(self, text, k=10):
+        """Return the k documents most similar to the text, best first"""
+        return self.query_batch([text], k)
+
+    def query_batch(self, texts, k=10):
+        """Rank the collection against several texts with a single matrix multiply"""
+        results = {"ids": [], "documents": [], "metadatas": [], "scores": []}
+        k = min(k, len(self.documents))
+        if k <= 0:
+            for _ in texts:
+                results["ids"].append([])
+                results["documents"].append([])
+                results["metadatas"].append([])
+                results["scores"].append([])
+            return results
+
+        queries = self.embedder.embed(list(texts))
+        # (n_docs, dim) @ (dim, n_queries); embeddings are normalized, so this is cosine similarity
+        similarities = self.matrix @ queries.T
+        if self.quantize:
+            similarities *= self.scales[:, None]
+
+        for column in range(similarities.shape[1]):
+            scores = similarities[:, column]
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind='stable')]
+            results["ids"].append([self.ids[i] for i in top])
+            results["documents"].append([self.documents[i] for i in top])
+            results["metadatas"].append([self.metadatas[i] for i in top])
+            results["scores"].append([float(scores[i]) for i in top])
+        return results
+
+    def save(self, directory: str):
+        """Write the embedding matrix as .npy files and the documents, ids and metadata as a chunk store file"""
+        os.makedirs(directory, exist_ok=True)
+        # Write to temporary files and rename them into place, so a process that still
+        # memory-maps the previous files keeps reading them
+        _save_array(os.path.join(directory, self.MATRIX_FILE), self.matrix)
+        if self.quantize:
+            _save_array(os.path.join(directory, self.SCALES_FILE), self.scales)
+        self.chunks.save(os.path.join(directory, self.CHUNKS_FILE))
+        # The header is written last, so a directory without it is incomplete
+        header_path = os.path.join(directory, self.HEADER_FILE)
+        with open(header_path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump({"embedder": self.embedder.name, "count": len(self.documents)}, file)
+        os.replace(header_path + '.tmp', header_path)
+
+    def load(self, directory: str) -> bool:
+        """Memory-map a saved matrix and documents; returns False when nothing usable is saved there.
+
+        Nothing is copied into the process, so every worker that loads the same directory shares
+        one copy of the corpus in the page cache.
+        """
+        matrix_path = os.path.join(directory, self.MATRIX_FILE)
+        header_path = os.path.join(directory, self.HEADER_FILE)
+        if not os.path.exists(matrix_path) or not os.path.exists(header_path):
+            return False
+        if not os.path.exists(os.path.join(directory, self.CHUNKS_FILE)):
+            return False
+
+        with open(header_path, 'r', encoding='utf-8') as file:
+            saved = json.load(file)
+        if saved.get("embedder") != self.embedder.name:
+            print(f"Saved embeddings in {directory} were built by {saved.get('embedder')}; ignoring them")
+            return False
+
+        matrix = np.load(matrix_path, mmap_mode='r')
+        self.quantize = matrix.dtype == np.int8
+        if self.quantize:
+            self.scales = np.load(os.path.join(directory, self.SCALES_FILE), mmap_mode='r')
+        self.matrix = matrix
+        self.chunks = ChunkStore.load(os.path.join(directory, self.CHUNKS_FILE))
+        return True